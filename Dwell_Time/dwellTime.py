@@ -6,7 +6,7 @@ import threading
 import configparser
 import os
 from datetime import datetime
-from utilities import setupDB, VideoCaptureBuffer, setupFtp
+from utilities import VideoCaptureBuffer
 import utilities as util
 import logging
 import traceback
@@ -20,6 +20,9 @@ config.read(config_path)
 # acces Logger File
 logger = logging.getLogger('dwellTime_logger')
 
+# alert name -> [Evidence-<profile>] config section its image is encoded with
+EVIDENCE_PROFILES = {"dwellTime": "dwell_time", "waitingTime": "dwell_time", "staff_absent": "staff_absent"}
+
 def calculateDwellTime(id, allPeronPresentTime, allPersonsPresent, idTimeMapping, incTime):
     try:
         if id not in allPersonsPresent:
@@ -31,20 +34,16 @@ def calculateDwellTime(id, allPeronPresentTime, allPersonsPresent, idTimeMapping
         logger.error(f"Error in calculateDwellTime: {e}")
         return 0
     
-def saveDataInLocalDB(conn, api_data):
+def saveDataInLocalDB(outbox, api_data):
     try:
-        cursor = conn.cursor
-        cursor.execute('''INSERT INTO DwellTime_Ananlytics (companyCode, exhibitionCode, boothCode, alertType, filepath, mimeType, alert_status, dateandtime, remark) 
+        outbox.execute('''INSERT INTO DwellTime_Ananlytics (companyCode, exhibitionCode, boothCode, alertType, filepath, mimeType, alert_status, dateandtime, remark) 
                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
                           (api_data["company_code"], api_data["exhibition_code"], api_data["booth_code"], api_data["alert_type"], 
                            api_data.get("filepath", ""), api_data.get("mime_type", ""), api_data.get("alert_status", ""), api_data["dateandtime"], api_data.get("remark", "")))
-        conn.commit()
-        conn.close()
     except Exception as e:
         logger.error(f"Error in saveDataInLocalDB: {e}")
-        conn.close()
         return False
-def sendData(folderName, url, frame, comp, exhinbit, booth, camId,alertType = "dwellTime",  table = None, waitingTimeData = None):
+def sendData(folderName, url, frame, comp, exhinbit, booth, camId,alertType = "dwellTime",  table = None, waitingTimeData = None, spool = False, region = None):
     try:
         if alertType == "dwellTime":
             alertType = 9
@@ -59,30 +58,17 @@ def sendData(folderName, url, frame, comp, exhinbit, booth, camId,alertType = "d
         created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
         ftpLocation = None
         if frame is not None:
-            try:      
-                ftp = setupFtp(config["FTP"]["userName"], config["FTP"]["password"], config["FTP"]["host"], int(config["FTP"]["port"]))
-            except Exception as e:
-                logger.error(f"error in making directory {e}") 
-                
             timeStamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
             ftpFileName  = f"{comp}_{exhinbit}_{booth}_{timeStamp}_{camId}_{alertName}.jpg"
             ftpPath = config["FTP"].get("ftp_location")
             ftpLocation = os.path.join(ftpPath,booth, datetime.now().date().strftime("%Y-%m-%d"), ftpFileName)
-            ftpRes = util.uploadFileOnFtp(ftp, frame, ftpLocation)
-            if not ftpRes:
-                logger.error("Error in uploadFileOnFtp")
-                subFolderName = f"{folderName}/{datetime.now().date()}"
-                if not os.path.exists(subFolderName):
-                    os.makedirs(subFolderName)
-                imagePath = f"{subFolderName}/{ftpFileName}"
-                success = cv2.imwrite(imagePath, frame)
-                if success:
-                    logger.error(f"Image saved to {imagePath}")
-                else:
-                    logger.error(f"Failed to save image to {imagePath}")
-                
-            if ftp is not None:
-                ftp.close()
+            # encoded once here through the evidence profile, the spool keeps these exact bytes for the retry
+            imageBytes = util.getEvidenceProfile(EVIDENCE_PROFILES[alertName]).encode(frame, region)
+            ftpRes = imageBytes is not None and not spool and util.getFtpPool(config["FTP"]).uploadBytes(imageBytes, ftpLocation)
+            if not ftpRes and imageBytes is not None:
+                if not spool:
+                    logger.error(f"FTP pool upload of {ftpLocation} failed, spooling the image")
+                util.getImageSpool(folderName).put(os.path.join(str(datetime.now().date()), ftpFileName), imageBytes)
                         
         api_data = {
             "company_code": comp,
@@ -103,78 +89,54 @@ def sendData(folderName, url, frame, comp, exhinbit, booth, camId,alertType = "d
                 "mime_type": "image/jpg",
             })
             
-        res = util.sendRequest(url, api_data)
+        res = not spool and util.sendRequest(url, api_data, "count" if alertName == "waitingTime" else "alert")
         if not res:
-            try:
-                conn = setupDB(table)
-            except Exception as e:
-                logger.error(f"Error in setupDB: {e}")
-            saveDataInLocalDB(conn, api_data)
+            saveDataInLocalDB(util.getOutbox(table), api_data)
     except Exception as e:
         logger.error(f"Error in sendData: {e}\n{traceback.format_exc()}")
         return None
     
+def submitAlert(priority, args, kwargs):
+    # when the upload queue is full the alert is saved locally for sendPreviousData
+    util.getUploadExecutor(config["Upload"]).submit(priority, sendData, args, kwargs,
+                                                    spool = lambda: sendData(*args, spool = True, **kwargs))
+    
+def rowToApiData(row):
+    return {
+        "company_code": row[1],
+        "exhibition_code": row[2],
+        "booth_code": row[3],
+        "alert_type": row[4],
+        "dateandtime": row[8],
+        "filepath": row[5],
+        "mime_type": row[6],
+        "alert_status": row[7],
+        "remark": row[9] if row[9] else "",
+    }
+
 def sendPreviousData(folderName, url,booth, table = None):
     try:
+        drainInfo = config["Drain"]
+        limiter = util.getDrainLimiter(drainInfo)
+        workers = drainInfo.getint("workers", 4)
         if config.get("DEFAULT", "FTP", fallback=None) is not None:
             if os.path.exists(folderName):
-                if len(os.listdir(folderName)) > 0:   
-                    try:      
-                        ftp = setupFtp(config["FTP"]["userName"], config["FTP"]["password"], config["FTP"]["host"], int(config["FTP"]["port"]))
-                    except Exception as e:
-                        logger.error(f"error in making directory {e}")
-                    if os.path.exists(folderName):
-                        for subfolder in os.listdir(folderName):
-                            imageFolder = os.path.join(folderName, subfolder)
-                            images = [f for f in os.listdir(imageFolder) if f.lower().endswith(".jpg")]
-                            ftpPath = config["FTP"].get("ftp_location")
-                            ftpLocation = os.path.join(ftpPath,booth,subfolder)
-                            ftp.ftp_mkdir_recursive(ftpLocation)
-                            for image in images:
-                                ftpImageLocation = os.path.join(ftpLocation, image)
-                                frame  = cv2.imread(os.path.join(imageFolder, image))
-                                ftpres = util.uploadFileOnFtp(ftp, frame, ftpImageLocation)
-                                if ftpres:
-                                    os.remove(os.path.join(imageFolder, image))
-                                else:
-                                    if ftp is not None:
-                                        ftp.close()
-                                    ftp.connect()
-                            if not os.listdir(imageFolder):
-                                os.rmdir(imageFolder)
-                    if ftp is not None:
-                        ftp.close()
-        try:
-            conn = setupDB(table)
-        except Exception as e:
-            logger.error(f"Error in setupDB: {e}")
-            
-        cursor = conn.cursor
-        rows = cursor.execute("SELECT * FROM DwellTime_Ananlytics").fetchall()
-        for row in rows:
-            api_data = {
-                "company_code": row[1],
-                "exhibition_code": row[2],
-                "booth_code": row[3],
-                "alert_type": row[4],
-                "dateandtime": row[8],
-                "filepath": row[5],
-                "mime_type": row[6],
-                "alert_status": row[7],
-                "remark": row[9] if row[9] else "",
-            }
-            res = util.sendRequest(url, api_data)
-            if res:
-                conn.execute("DELETE FROM DwellTime_Ananlytics WHERE id = ?", (row[0],))
-                conn.commit()
-            conn.close()
+                ftpPool = util.getFtpPool(config["FTP"])
+                ftpLocation = os.path.join(config["FTP"].get("ftp_location"), booth)
+                # spooled images are the jpg bytes encoded at alert time, streamed back from disk as they are
+                sent = util.getImageSpool(folderName).drain(lambda path, relPath: ftpPool.uploadFile(path, os.path.join(ftpLocation, relPath)), workers = workers, limiter = limiter)
+                if sent:
+                    logger.info(f"Uploaded {sent} spooled images")
+        sent = util.drainOutbox(util.getOutbox(table), "DwellTime_Ananlytics", rowToApiData, url,
+                                pageSize = drainInfo.getint("page_size", 200), workers = workers, limiter = limiter)
+        if sent:
+            logger.info(f"Sent {sent} backlog records")
                     
     except Exception as e:
         logger.error(f"Error in sendPreviousData: {e}")
-        conn.close()
         return None
 
-def sendInactivePersonsWaitingTime(personIds, allPeronPresentTime, comp, exhibit, booth, camId, url = None, table = None, activeIds = {}, fps = 30):
+def sendInactivePersonsWaitingTime(personIds, allPeronPresentTime, comp, exhibit, booth, camId, url = None, table = None, activeIds = {}, fps = 30, incTime = None):
     try:
         inactivePersons = {}
         allIds = []
@@ -186,7 +148,7 @@ def sendInactivePersonsWaitingTime(personIds, allPeronPresentTime, comp, exhibit
                 else:
                     if activeIds.get(id) is None:
                         activeIds[id] = 0
-                    activeIds[id] +=1/fps
+                    activeIds[id] += incTime if incTime is not None else 1/fps
             else:
                 if id in activeIds:
                     activeIds.pop(id, None)
@@ -206,7 +168,7 @@ def sendInactivePersonsWaitingTime(personIds, allPeronPresentTime, comp, exhibit
                 "camera_id": camId,
                 "Waiting_time_seconds": int(inactivePersons[id]),
             })
-        threading.Thread(target = sendData, args = (None, url, None, comp, exhibit, booth, camId), kwargs= {'alertType' :"waitingTime", 'table' : table, 'waitingTimeData' : json.dumps(waitingTimeData)}).start()
+        submitAlert(util.PRIORITY_COUNT, (None, url, None, comp, exhibit, booth, camId), {'alertType' :"waitingTime", 'table' : table, 'waitingTimeData' : json.dumps(waitingTimeData)})
         # sendData(None, url, None, comp, exhibit, booth, camId, alertType= "waitingTime", table = table, waitingTimeData = json.dumps(inactivePersons))
     except Exception as e:
         logger.error(f"Error in sendInactivePersonsWaitingTime: {e}")
@@ -226,7 +188,23 @@ def detectDwellTime(cameraInfo, frameWidth, frameHeight,startTime, endTime, url,
         
         
         model = YOLO("yolov8n.pt")
-        cap = VideoCaptureBuffer(video)
+        # decoded straight to the analysis size into reused buffers
+        captureBackend = config["Dwell-Time"].get("capture_backend", "auto")
+        captureSubstream = config["Dwell-Time"].get("substream", "auto")
+        analysisFps = float(config["Dwell-Time"].get("analysis_fps", 5))
+        # the buffer reconnects a lost camera itself with a capped backoff, the loop only hears about it
+        cameraLost = threading.Event()
+        def onCameraState(state, failures, retryIn):
+            if state == "connected":
+                logger.info(f"Camera {cameraId} connected")
+            else:
+                cameraLost.set()
+                logger.error(f"Camera {cameraId} {state} after {failures} failures, retrying in {retryIn:g}s")
+        cap = VideoCaptureBuffer(video, analysis_fps = analysisFps, output_size = (frameWidth, frameHeight), backend = captureBackend, substream = captureSubstream,
+                                 on_state = onCameraState,
+                                 backoff = float(config["Dwell-Time"].get("reconnect_backoff_seconds", 1)),
+                                 max_backoff = float(config["Dwell-Time"].get("reconnect_max_backoff_seconds", 30)),
+                                 read_timeout = float(config["Dwell-Time"].get("read_timeout_seconds", 10)))
                          
         if not os.path.exists(folderName):
             os.makedirs(folderName)
@@ -235,9 +213,7 @@ def detectDwellTime(cameraInfo, frameWidth, frameHeight,startTime, endTime, url,
         if config.get("DEFAULT", "FTP", fallback=None) is not None:
             ftpFolder = f"{config['FTP']['ftp_location']}/{booth}/{datetime.now().date()}"  
             try:      
-                ftp = setupFtp(config["FTP"]["userName"], config["FTP"]["password"], config["FTP"]["host"], int(config["FTP"]["port"]))
-                ftp.ftp_mkdir_recursive(ftpFolder)
-                ftp.close()
+                util.getFtpPool(config["FTP"]).mkdir(ftpFolder)
             except Exception as e:
                 logger.error(f"error in making directory {e}")
             
@@ -245,26 +221,30 @@ def detectDwellTime(cameraInfo, frameWidth, frameHeight,startTime, endTime, url,
         personabsentTime = 0
         alertAlreadyDone = {}
         syncTime = int(time.time())
-        lastFrameTime =  datetime.now()
+        lastFrameTime = None
         # cameraLastResponseTime = 0
         activeIds = {}
+        frameSeq = 0
+        frameTimeout = float(config["Dwell-Time"].get("frame_timeout_seconds", 5))
         
         while datetime.now().time() >= startTime and datetime.now().time() < endTime:
-            ret, frame = cap.read()
-            if not ret:
-                cap.release()
-                cap = VideoCaptureBuffer(video)
-                time.sleep(1)
+            # each frame is processed once, the wait is bounded so the end time is still checked while the camera is away
+            frameSeq, frameTime, frame = cap.read_next(frameSeq, timeout = frameTimeout)
+            if frame is None:
+                lastFrameTime = None
                 continue
+            if cameraLost.is_set():
+                # the outage is not counted as time anyone spent in a roi
+                cameraLost.clear()
+                lastFrameTime = None
             
-            frame = cv2.resize(frame, (frameWidth, frameHeight))
             totalPersonPresent = 0 
             
-            now = datetime.now()
-            incTime = (now - lastFrameTime).total_seconds()
-            lastFrameTime = now
+            # elapsed time comes from capture timestamps, so it stays right at any analysis rate
+            incTime = frameTime - lastFrameTime if lastFrameTime is not None else 0
+            lastFrameTime = frameTime
             
-            fps =  cap.cap.get(cv2.CAP_PROP_FPS)
+            fps =  cap.source_fps()
             # incTime = 1/fps if fps > 0 else 0.04
             
             results =  model.track(frame,imgsz = 640, conf=0.2,persist=True, iou = 0.4, tracker = "bytetrack.yaml", verbose =False)
@@ -329,17 +309,13 @@ def detectDwellTime(cameraInfo, frameWidth, frameHeight,startTime, endTime, url,
                                             x, y, top_left,bottom_right  = util.fetchTextScale(int(rois.get(roi)[2]["x"]), int(rois.get(roi)[2]["y"]), text = f"Time(in sec): {int(personTime)}" )
                                             cv2.rectangle(newFrame, top_left, bottom_right, (255, 255, 255), thickness=cv2.FILLED)
                                             newFrame = cv2.putText(newFrame, f"Time(in sec): {int(personTime)}", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                                            threading.Thread(
-                                                target=sendData,
-                                                args=(folderName, url, newFrame, comp, exhibit, booth, cameraId),
-                                                kwargs={'alertType': 'dwellTime', 'table': table}
-                                            ).start()
+                                            submitAlert(util.PRIORITY_IMAGE, (folderName, url, newFrame, comp, exhibit, booth, cameraId), {'alertType': 'dwellTime', 'table': table, 'region': util.roiBounds(rois.get(roi))})
                                             alertAlreadyDone[roi].append(id)
                                         # util.saveDataInFile(fileName, personTime, idTimeMapping[roi][id], roi)
                             if util.personInsidePolygon(rois.get(roi), (x, y)) and roi != "dwellTime":
                                 totalPersonPresent +=1
                 if roi == "waitingTime":
-                    sendInactivePersonsWaitingTime(personIds, allPeronPresentTime[roi], comp, exhibit, booth, cameraId, table = table, url = url, activeIds = activeIds, fps = fps)
+                    sendInactivePersonsWaitingTime(personIds, allPeronPresentTime[roi], comp, exhibit, booth, cameraId, table = table, url = url, activeIds = activeIds, fps = fps, incTime = incTime)
                     # threading.Thread(
                     #     target=sendInactivePersonsWaitingTime, 
                     #     args = (personIds, allPeronPresentTime[roi], comp, exhibit, booth, cameraId ), 
@@ -353,11 +329,7 @@ def detectDwellTime(cameraInfo, frameWidth, frameHeight,startTime, endTime, url,
                                 x, y, top_left,bottom_right  = util.fetchTextScale(int(rois.get(roi)[0]["x"]), int(rois.get(roi)[0]["y"]) )
                                 cv2.rectangle(newFrame, top_left, bottom_right, (255, 255, 255), thickness=cv2.FILLED)
                                 newFrame = cv2.putText(newFrame, f"STAFF_ABSENT", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                                threading.Thread(
-                                            target=sendData,
-                                            args=(folderName, url, newFrame, comp, exhibit, booth, cameraId),
-                                            kwargs={'alertType': 'personPresent', 'table': table}
-                                        ).start()
+                                submitAlert(util.PRIORITY_IMAGE, (folderName, url, newFrame, comp, exhibit, booth, cameraId), {'alertType': 'personPresent', 'table': table, 'region': util.roiBounds(rois.get(roi))})
                                 # util.saveDataInFile(fileName, personabsentTime, idTimeMapping[roi][id], roi)
                                 coolDown -= incTime
                             else:
@@ -373,6 +345,9 @@ def detectDwellTime(cameraInfo, frameWidth, frameHeight,startTime, endTime, url,
                     break
             if int(time.time()) - syncTime > 300:
                 threading.Thread(target =  sendPreviousData, args = (folderName, url,booth),kwargs={'table': table}).start()
+                logger.info(f"Upload queue stats: {util.getUploadExecutor(config['Upload']).stats()}")
+                logger.info(f"Evidence stats: {util.evidenceStats()}")
+                logger.info(f"Camera {cameraId} analysed {cap.seq} frames at {cap.measured_fps:.1f} fps, skipped {cap.skipped} at decode, dropped {cap.dropped}")
                 syncTime = int(time.time())
         logger.info("Time Over")   
                                 
@@ -1,4 +1,5 @@
 import dwellTime
+import utilities
 import configparser
 import os
 import json
@@ -18,17 +19,13 @@ if not os.path.exists(logFolderName):
     
 log_filename = f"DwellTime_{datetime.now().date()}.log"
 log_filepath = os.path.join(os.getcwd(),logFolderName, log_filename)
-logger = logging.getLogger('dwellTime_logger')
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    file_mode = 'a' if os.path.exists(log_filepath) else 'w'
-    file_handler = logging.FileHandler(log_filepath, mode=file_mode)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+logger = utilities.setupLogging('dwellTime_logger', log_filepath, config["Logging"], shared = True)
 
 def dwellTimeMain():
     try:
+        utilities.getHttpClient(config["HTTP"])
+        utilities.getBandwidthGovernor(config["Bandwidth"])
+        utilities.configureEvidenceProfiles(config)
         cameras = json.loads(config["Dwell-Time"]["cameras_info"])
         frameWidth, frameHeight = int(config["Dwell-Time"]["frameWidth"]), int(config["Dwell-Time"]["frameHeight"])
         url  = config["URLS"].get("alertApi")
@@ -0,0 +1,41 @@
+import configparser
+import logging
+import os
+import unittest
+
+try:
+    import dwellTime
+    import evidence
+except ImportError:
+    dwellTime = None
+
+# run from Dwell_Time: python -m unittest test_evidenceProfiles
+
+configPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.ini")
+
+
+@unittest.skipIf(dwellTime is None, "dwellTime dependencies are not installed")
+class EvidenceProfileConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.config = configparser.ConfigParser()
+        self.assertTrue(self.config.read(configPath))
+        evidence.evidenceProfiles.clear()
+        evidence.configureEvidenceProfiles(self.config)
+
+    def test_every_alert_has_a_configured_profile(self):
+        for alertName, profileName in dwellTime.EVIDENCE_PROFILES.items():
+            with self.subTest(alertName = alertName):
+                section = self.config[f"Evidence-{profileName}"]
+                with self.assertNoLogs("shared.evidence", level = logging.WARNING):
+                    profile = evidence.getEvidenceProfile(profileName)
+                self.assertEqual(profile.crop, section.getboolean("crop", False))
+                self.assertEqual(profile.quality, section.getint("quality", 95))
+                self.assertEqual(profile.maxDimension, section.getint("max_dimension", 0))
+
+    def test_unknown_profile_warns(self):
+        with self.assertLogs("shared.evidence", level = logging.WARNING):
+            evidence.getEvidenceProfile("not_configured")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+import json
+import time
+import os
+import logging
+import traceback
+
+logger = logging.getLogger("sackBag_logger.checkpoint")
+
+
+class BayCheckpointStore:
+    """Latest counting state per bay, written by a background thread so the frame loop only pays for a snapshot."""
+    def __init__(self, dbPath = None):
+        self.dbPath = dbPath or os.path.join(os.path.dirname(__file__), 'sackCheckpoint.db')
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        conn = self.connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS bay_checkpoints (
+            bayNo VARCHAR(50) PRIMARY KEY,
+            countingStartTime TIMESTAMP,
+            isAlertTriggerd BOOLEAN,
+            state TEXT,
+            updatedAt REAL
+        )''')
+        conn.commit()
+        conn.close()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.dbPath)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def save(self, bayNo, startTime, registry, alertTriggered):
+        with self.lock:
+            self.pending[bayNo] = (startTime, int(alertTriggered), json.dumps(registry.snapshot(), separators=(",", ":")), time.time())
+        self.wakeup.set()
+
+    def clear(self, bayNo):
+        with self.lock:
+            self.pending[bayNo] = None
+        self.wakeup.set()
+
+    def load(self, bayNo, graceSeconds):
+        conn = self.connect()
+        try:
+            row = conn.execute('''select countingStartTime, isAlertTriggerd, state, updatedAt from bay_checkpoints where bayNo = ?''', (bayNo,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or time.time() - row[3] > graceSeconds:
+            return None
+        return {"startTime": row[0], "alertTriggered": row[1], "state": json.loads(row[2])}
+
+    def run(self):
+        conn = self.connect()
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            try:
+                for bayNo, checkpoint in pending.items():
+                    if checkpoint is None:
+                        conn.execute('''delete from bay_checkpoints where bayNo = ?''', (bayNo,))
+                    else:
+                        conn.execute('''insert or replace into bay_checkpoints (bayNo, countingStartTime, isAlertTriggerd, state, updatedAt) values (?, ?, ?, ?, ?)''',
+                                     (bayNo, *checkpoint))
+                conn.commit()
+            except Exception:
+                logger.error("Error in BayCheckpointStore:\n" + traceback.format_exc())
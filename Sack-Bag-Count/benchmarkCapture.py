@@ -0,0 +1,80 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import utilities
+
+# Bytes allocated and CPU time per analysed frame, for the old capture path (decode a new full size
+# frame, then cv2.resize it into another new array in the consumer) against VideoCaptureBuffer
+# decoding to the analysis size into its reused ring. Without --source it writes a synthetic clip.
+
+
+def syntheticClip(path, width, height, frames):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 25, (width, height))
+    rng = np.random.default_rng(7)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for index in range(frames):
+        writer.write(np.roll(base, index * 8, axis=1))
+    writer.release()
+
+
+def measure(name, nextFrame, frames):
+    # the traced peak inside each frame, above what was live before it, is what that frame allocated
+    tracemalloc.start()
+    allocated = []
+    cpuStart = time.process_time()
+    for _ in range(frames):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        if nextFrame() is None:
+            break
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    cpu = time.process_time() - cpuStart
+    tracemalloc.stop()
+    if not allocated:
+        print(f"{name:<16} no frames")
+        return
+    perFrame = sum(allocated) / len(allocated)
+    print(f"{name:<16} {len(allocated):>6} {perFrame / 1024:>14.1f} {cpu / len(allocated) * 1000:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", help="rtsp url or video file, a synthetic 2560x1440 clip when omitted")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--width", type=int, default=960)
+    parser.add_argument("--height", type=int, default=640)
+    parser.add_argument("--backend", default="auto", help="auto, ffmpeg or opencv for the ring buffer capture")
+    args = parser.parse_args()
+
+    source = args.source
+    if source is None:
+        source = os.path.join(tempfile.mkdtemp(), "synthetic.mp4")
+        syntheticClip(source, 2560, 1440, args.frames + 10)
+    size = (args.width, args.height)
+
+    print(f"{'mode':<16} {'frames':>6} {'KiB/frame':>14} {'cpu ms/frame':>12}")
+
+    cap = cv2.VideoCapture(source)
+    def consumerResize():
+        ret, frame = cap.read()
+        if not ret:
+            return None
+        return cv2.resize(frame, size)
+    measure("consumer resize", consumerResize, args.frames)
+    cap.release()
+
+    capture = utilities.VideoCaptureBuffer(source, output_size = size, backend = args.backend)
+    lastSeq = [0]
+    def ringBuffer():
+        lastSeq[0], _, frame = capture.read_next(lastSeq[0], timeout = 5)
+        return frame
+    measure(f"ring ({capture.backend})", ringBuffer, args.frames)
+    capture.release()
+
+
+if __name__ == "__main__":
+    main()
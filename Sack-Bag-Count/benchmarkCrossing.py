@@ -0,0 +1,115 @@
+import argparse
+import json
+import random
+from trackRegistry import TrackRegistry
+
+# Compares side and segment crossing counts when only every n-th frame of a 25 fps source is analysed.
+# Without --clip it replays synthetic sack trajectories with perfect track ids; with --clip it runs
+# the detector and ByteTrack on a recorded clip.
+
+SOURCE_FPS = 25
+ANALYSIS_FPS = [25, 12, 6]
+
+
+def insidePolygon(points, point):
+    x, y = point
+    inside = False
+    j = len(points) - 1
+    for i in range(len(points)):
+        xi, yi = points[i]["x"], points[i]["y"]
+        xj, yj = points[j]["x"], points[j]["y"]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def syntheticTracks(loi, seed = 7, sacks = 200):
+    rng = random.Random(seed)
+    (x1, y1), (x2, y2) = loi
+    frames = {}
+    expected = {"loading": 0, "unLoading": 0}
+    startFrame = 0
+    for id in range(1, sacks + 1):
+        loading = rng.random() < 0.7
+        x = rng.uniform(x1 + 10, x2 - 10)
+        startY, endY = (y1 + 200, y1 - 200) if loading else (y1 - 200, y1 + 200)
+        speed = rng.uniform(15, 60)
+        steps = int(abs(endY - startY) / speed)
+        for step in range(steps + 1):
+            y = startY + (endY - startY) * step / steps
+            frames.setdefault(startFrame + step, {})[id] = (int(x + rng.uniform(-3, 3)), int(y))
+        expected["loading" if loading else "unLoading"] += 1
+        startFrame += rng.randint(3, 20)
+    return [frames.get(i, {}) for i in range(max(frames) + 1)], expected
+
+
+def countSynthetic(frames, loi, roi, direction, mode, stride):
+    registry = TrackRegistry(loi[0], loi[1], direction, mode = mode)
+    for objects in frames[::stride]:
+        if mode == "side":
+            objects = {id: point for id, point in objects.items() if insidePolygon(roi, point)}
+        registry.update(objects)
+    return registry.loadingCount, registry.unLoadingCount
+
+
+def countClip(clip, modelName, loi, roi, direction, mode, stride, frameWidth, frameHeight):
+    import cv2
+    from ultralytics import YOLO
+    import utilities
+    model = YOLO(modelName)
+    registry = TrackRegistry(loi[0], loi[1], direction, mode = mode)
+    cap = cv2.VideoCapture(clip)
+    index = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        index += 1
+        if (index - 1) % stride:
+            continue
+        frame = cv2.resize(frame, (frameWidth, frameHeight))
+        results = model.track(frame, imgsz = 640, conf=0.2, persist=True, iou = 0.4, tracker = "bytetrack.yaml", verbose = False)
+        objects = utilities.fetchObject(results, objects=[1], roi = roi if mode == "side" else None)
+        registry.update(objects.get(1, {}))
+    cap.release()
+    return registry.loadingCount, registry.unLoadingCount
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clip", help="recorded bay clip, synthetic trajectories are used when omitted")
+    parser.add_argument("--model", default="1207_50ep.pt")
+    parser.add_argument("--loi", default="[[300, 320], [700, 320]]")
+    parser.add_argument("--roi", default=None, help="json list of {x, y} points, defaults to a 80px band around the LOI")
+    parser.add_argument("--direction", default="left")
+    parser.add_argument("--framewidth", type=int, default=960)
+    parser.add_argument("--frameheight", type=int, default=640)
+    args = parser.parse_args()
+
+    loi = json.loads(args.loi)
+    if args.roi:
+        roi = json.loads(args.roi)
+    else:
+        (x1, y1), (x2, y2) = loi
+        roi = [{"x": x1 - 50, "y": y1 - 40}, {"x": x2 + 50, "y": y2 - 40}, {"x": x2 + 50, "y": y2 + 40}, {"x": x1 - 50, "y": y1 + 40}]
+
+    if args.clip:
+        expected = None
+    else:
+        frames, expected = syntheticTracks(loi)
+        print(f"expected loading {expected['loading']} unloading {expected['unLoading']}")
+
+    print(f"{'mode':<8} {'fps':>4} {'loading':>8} {'unloading':>10}")
+    for mode in ("side", "segment"):
+        for fps in ANALYSIS_FPS:
+            stride = max(1, round(SOURCE_FPS / fps))
+            if args.clip:
+                loading, unLoading = countClip(args.clip, args.model, loi, roi, args.direction, mode, stride, args.framewidth, args.frameheight)
+            else:
+                loading, unLoading = countSynthetic(frames, loi, roi, args.direction, mode, stride)
+            print(f"{mode:<8} {fps:>4} {loading:>8} {unLoading:>10}")
+
+
+if __name__ == "__main__":
+    main()
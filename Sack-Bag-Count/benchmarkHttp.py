@@ -0,0 +1,91 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+import utilities
+
+# Sends the same analytics records to a local stub api three ways: a bare requests.post per record
+# (the old sendRequest), the pooled HttpClient per record, and HttpClient batch mode.
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0
+    records = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"null")
+        with StubHandler.lock:
+            StubHandler.records += len(body) if isinstance(body, list) else 1
+        if StubHandler.latency:
+            time.sleep(StubHandler.latency)
+        payload = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sampleRecord(index):
+    return {
+        "company_code": "democompany",
+        "store_code": "store1",
+        "bay_code": f"bay{index % 8}",
+        "loading_count": index,
+        "unloading_count": 0,
+        "counting_start_time": "2025-05-16T10:00:00",
+        "counting_end_time": "2025-05-16T10:30:00",
+    }
+
+
+def plainPost(url, record):
+    return requests.post(url, json=record, headers={'content-type': 'application/json'}).status_code == 200
+
+
+def run(name, send, items, total, workers):
+    # send returns how many records of its item the api acknowledged
+    StubHandler.records = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        acked = sum(executor.map(send, items))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {elapsed:>8.2f}s {total / elapsed:>10.1f} rec/s  acked {acked}/{total}  received {StubHandler.records}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=2, help="server side delay per request")
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/analytics"
+    records = [sampleRecord(index) for index in range(args.records)]
+
+    client = utilities.getHttpClient()
+    print(f"{'mode':<16} {'time':>9} {'throughput':>14}")
+    run("requests.post", lambda record: plainPost(url, record), records, len(records), args.workers)
+    run("pooled", lambda record: client.post(url, record).status_code == 200, records, len(records), args.workers)
+
+    # the stub takes lists on the record path too
+    client.batchSize = args.batch_size
+    client.batchUrl = url
+    chunks = [records[start:start + args.batch_size] for start in range(0, len(records), args.batch_size)]
+    run("batch", lambda chunk: sum(utilities.sendRecords(url, chunk)), chunks, len(records), args.workers)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
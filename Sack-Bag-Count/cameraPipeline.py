@@ -0,0 +1,266 @@
+import logging
+import json
+import queue
+import threading
+import traceback
+import cv2
+import numpy as np
+import utilities
+from motionGate import MotionGate
+
+logger = logging.getLogger("sackBag_logger.capture")
+
+pipelines = {}
+pipelinesLock = threading.Lock()
+
+
+class BayView:
+    def __init__(self, bayNo, roi, loi, frameWidth, frameHeight, useRoi = True, queueSize = 500):
+        self.bayNo = bayNo
+        self.roi = roi
+        self.loi = loi
+        self.useRoi = useRoi
+        self.roiMask = None
+        if roi:
+            self.roiMask = np.zeros((frameHeight, frameWidth), dtype=np.uint8)
+            cv2.fillPoly(self.roiMask, [np.array([[int(p["x"]), int(p["y"])] for p in roi], dtype=np.int32)], 1)
+        # the tracks of every analysed frame in order, so a bay busy drawing or uploading catches up instead of missing a crossing
+        self.tracks = queue.Queue(maxsize = queueSize)
+        self.dropped = 0
+
+    def push(self, packet):
+        objects, crosses = packet.objectsFor(self.bayNo, useRoi = self.useRoi)
+        entry = (packet.seq, len(packet.ids), objects, crosses)
+        while True:
+            try:
+                self.tracks.put_nowait(entry)
+                return
+            except queue.Full:
+                # only a bay stalled for the whole queue loses frames, the oldest go first
+                try:
+                    self.tracks.get_nowait()
+                    self.dropped += 1
+                    logger.error(f"Bay {self.bayNo} is {self.tracks.maxsize} frames behind, dropping its oldest tracks")
+                except queue.Empty:
+                    pass
+
+
+class FramePacket:
+    """Shared detections for one analysed frame plus the per-bay ROI and LOI tests, computed in one pass."""
+    def __init__(self, seq, frame, results, bays, captureTime = None):
+        self.seq = seq
+        self.captureTime = captureTime
+        self.frame = frame
+        self.results = results
+        self.ids, self.points = self.trackedObjects(results, objects = [1])
+        self.inside = {}
+        self.crosses = {}
+        if bays and len(self.ids):
+            self.linePass(bays)
+
+    def trackedObjects(self, results, objects):
+        boxes = results[0].boxes
+        if boxes.id is None or len(boxes) == 0:
+            return np.empty(0, dtype=int), np.empty((0, 2), dtype=int)
+        cls = boxes.cls.int().cpu().numpy()
+        keep = np.isin(cls, objects)
+        ids = boxes.id.int().cpu().numpy()[keep]
+        points = boxes.xywh.cpu().numpy()[keep][:, :2].astype(int)
+        return ids, points
+
+    def linePass(self, bays):
+        lois = np.array([[bay.loi[0][:2], bay.loi[1][:2]] for bay in bays], dtype=np.float64)
+        a, b = lois[:, 0], lois[:, 1]
+        px, py = self.points[:, 0], self.points[:, 1]
+        crosses = (b[:, 0] - a[:, 0])[:, None] * (py[None, :] - a[:, 1][:, None]) - (b[:, 1] - a[:, 1])[:, None] * (px[None, :] - a[:, 0][:, None])
+        for index, bay in enumerate(bays):
+            self.crosses[bay.bayNo] = crosses[index]
+            if bay.roiMask is None:
+                self.inside[bay.bayNo] = np.ones(len(self.ids), dtype=bool)
+            else:
+                height, width = bay.roiMask.shape
+                self.inside[bay.bayNo] = bay.roiMask[np.clip(py, 0, height - 1), np.clip(px, 0, width - 1)] > 0
+
+    def objectsFor(self, bayNo, useRoi = True):
+        crosses = self.crosses.get(bayNo)
+        if crosses is None:
+            return {}, {}
+        keep = self.inside[bayNo] if useRoi else np.ones(len(self.ids), dtype=bool)
+        objects, objectCrosses = {}, {}
+        for id, point, cross in zip(self.ids[keep], self.points[keep], crosses[keep]):
+            objects[int(id)] = (int(point[0]), int(point[1]))
+            objectCrosses[int(id)] = float(cross)
+        return objects, objectCrosses
+
+
+class CameraPipeline:
+    """One capture and detection loop per rtsp url, shared by every bay that camera covers."""
+    def __init__(self, rtsp, engine, frameWidth, frameHeight, inferenceConfig = None, countingConfig = None, publisher = None, stateTopic = "sack/bag/camera", ownsEngine = False):
+        self.rtsp = rtsp
+        self.engine = engine
+        # an engine the first bay created just for this camera lives as long as the pipeline, not that bay
+        self.ownsEngine = ownsEngine
+        self.frameWidth = frameWidth
+        self.frameHeight = frameHeight
+        self.inferenceConfig = inferenceConfig
+        self.publisher = publisher
+        self.stateTopic = stateTopic
+        self.useRoi = countingConfig.get("crossing_mode", "side") == "side" if countingConfig is not None else True
+        self.queueSize = countingConfig.getint("bay_queue_frames", 500) if countingConfig is not None else 500
+        self.bays = {}
+        self.window = None
+        self.windowImgsz = None
+        self.gate = None
+        self.packet = None
+        self.seq = 0
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.tracker = self.engine.register(rtsp)
+
+        # capture runs on its own thread, so a slow inference skips to the freshest frame instead of letting the stream queue up
+        self.capture = utilities.VideoCaptureBuffer(
+            rtsp,
+            analysis_fps = countingConfig.getfloat("analysis_fps", 0) if countingConfig is not None else 0,
+            on_state = self.onState,
+            backoff = countingConfig.getfloat("reconnect_backoff_seconds", 1) if countingConfig is not None else 1,
+            max_backoff = countingConfig.getfloat("reconnect_max_backoff_seconds", 30) if countingConfig is not None else 30,
+            # decoded straight to analysis size; a packet frame stays valid while the bays copy it during the next two reads
+            output_size = (frameWidth, frameHeight),
+            ring_size = 4,
+            hold = 2,
+            backend = countingConfig.get("capture_backend", "auto") if countingConfig is not None else "auto",
+            substream = countingConfig.get("substream", "auto") if countingConfig is not None else "auto",
+            read_timeout = countingConfig.getfloat("read_timeout_seconds", 10) if countingConfig is not None else 10
+        )
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def attach(self, bayNo, roi, loi):
+        with self.lock:
+            # in segment mode the finite LOI is the gate, so tracks are followed outside the roi as well
+            self.bays[bayNo] = BayView(bayNo, roi, loi, self.frameWidth, self.frameHeight, useRoi = self.useRoi, queueSize = self.queueSize)
+            self.configureWindow()
+        logger.info(f"Bay {bayNo} attached to camera pipeline {self.rtsp} ({len(self.bays)} bays)")
+
+    def detach(self, bayNo):
+        with self.lock:
+            self.bays.pop(bayNo, None)
+            self.configureWindow()
+            return len(self.bays)
+
+    def configureWindow(self):
+        # crop and motion gate cover the union of the attached bays
+        config = self.inferenceConfig
+        windows = [utilities.inferenceWindow(bay.roi, bay.loi, 0, self.frameWidth, self.frameHeight) for bay in self.bays.values()]
+        windows = [window for window in windows if window is not None]
+        union = None
+        if windows:
+            union = (min(w[0] for w in windows), min(w[1] for w in windows), max(w[2] for w in windows), max(w[3] for w in windows))
+        self.window, self.windowImgsz, self.gate = None, None, None
+        if config is None or union is None:
+            return
+        if config.getboolean("crop_inference", False):
+            margin = config.getint("crop_margin", 40)
+            self.window = (max(0, union[0] - margin), max(0, union[1] - margin), min(self.frameWidth, union[2] + margin), min(self.frameHeight, union[3] + margin))
+            self.windowImgsz = config.getint("crop_imgsz", 320)
+        if config.getboolean("motion_gate", False):
+            self.gate = MotionGate(
+                window = self.window or union,
+                threshold = config.getfloat("motion_threshold", 0.01),
+                pixelDelta = config.getint("motion_pixel_delta", 25),
+                wakeFrames = config.getint("motion_wake_frames", 25),
+                minDutyCycle = config.getfloat("motion_min_duty_cycle", 0.1)
+            )
+
+    def onState(self, state, failures, retryIn):
+        with self.lock:
+            bays = list(self.bays)
+        if state == "connected":
+            logger.info(f"Camera for bays {bays} connected")
+        if self.publisher is not None:
+            self.publisher.publish(self.stateTopic, json.dumps({"bays": bays, "state": state, "failures": failures, "retryInSeconds": retryIn}))
+
+    def readTracks(self, bayNo, timeout = None):
+        # (seq, detections, objects, crosses) for the bay's next analysed frame, None on timeout
+        with self.lock:
+            bay = self.bays.get(bayNo)
+        if bay is None:
+            return None
+        try:
+            return bay.tracks.get(timeout = timeout)
+        except queue.Empty:
+            return None
+
+    def pending(self, bayNo):
+        with self.lock:
+            bay = self.bays.get(bayNo)
+        return bay.tracks.qsize() if bay is not None else 0
+
+    def readNext(self, afterSeq = 0, timeout = None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or (self.packet is not None and self.packet.seq > afterSeq), timeout)
+            if self.packet is not None and self.packet.seq > afterSeq:
+                return self.packet
+            return None
+
+    def run(self):
+        captureSeq = 0
+        while not self.stopped:
+            captureSeq, captureTime, frame = self.capture.read_next(captureSeq, timeout = 1)
+            if frame is None:
+                continue
+            with self.lock:
+                bays = list(self.bays.values())
+                window, windowImgsz, gate = self.window, self.windowImgsz, self.gate
+            try:
+                if gate is None or gate.check(frame):
+                    results = self.engine.track(self.rtsp, frame, imgsz = windowImgsz, window = window)
+                else:
+                    results = self.engine.skip(self.rtsp, frame)
+                packet = FramePacket(self.seq + 1, frame, results, bays, captureTime = captureTime)
+                for bay in bays:
+                    bay.push(packet)
+            except Exception:
+                logger.error(f"Error in camera pipeline {self.rtsp}:\n" + traceback.format_exc())
+                continue
+            with self.condition:
+                self.seq = packet.seq
+                self.packet = packet
+                self.condition.notify_all()
+        self.capture.release()
+
+    def gatedFraction(self):
+        gate = self.gate
+        return gate.gatedFraction() if gate is not None else None
+
+    def stop(self):
+        self.stopped = True
+        with self.condition:
+            self.condition.notify_all()
+        self.thread.join(timeout=5)
+        self.engine.unregister(self.rtsp, self.tracker)
+        if self.ownsEngine:
+            self.engine.stop()
+
+
+def attachBay(rtsp, bayNo, roi, loi, engine, frameWidth, frameHeight, inferenceConfig = None, countingConfig = None, publisher = None, stateTopic = "sack/bag/camera", ownsEngine = False):
+    # a bay joining a running pipeline uses that pipeline's engine, check pipeline.engine
+    with pipelinesLock:
+        pipeline = pipelines.get(rtsp)
+        if pipeline is None:
+            pipeline = CameraPipeline(rtsp, engine, frameWidth, frameHeight, inferenceConfig = inferenceConfig, countingConfig = countingConfig, publisher = publisher, stateTopic = stateTopic,
+                                      ownsEngine = ownsEngine)
+            pipelines[rtsp] = pipeline
+        pipeline.attach(bayNo, roi, loi)
+    return pipeline
+
+def detachBay(rtsp, bayNo):
+    with pipelinesLock:
+        pipeline = pipelines.get(rtsp)
+        if pipeline is None or pipeline.detach(bayNo) != 0:
+            return
+        pipelines.pop(rtsp, None)
+    # stopping joins the pipeline thread, which must not hold up other bays attaching or detaching
+    pipeline.stop()
+    logger.info(f"Camera pipeline {rtsp} stopped")
@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+import queue
+import json
+import logging
+
+logger = logging.getLogger("sackBag_logger.commands")
+
+
+class CommandQueue:
+    """In-process start/stop command queue, journaled to SQLite so unhandled commands survive a crash."""
+    def __init__(self, journalPath):
+        self.queue = queue.Queue()
+        self.sink = None
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(journalPath, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT,
+            receivedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        self.conn.commit()
+
+    def put(self, command):
+        with self.lock:
+            cursor = self.conn.execute("insert into commands (payload) values (?)", (json.dumps(command),))
+            self.conn.commit()
+            commandId = cursor.lastrowid
+        self.deliver((commandId, command))
+        return commandId
+
+    def setSink(self, sink):
+        # sink((commandId, command)) replaces the blocking get, e.g. to hand commands to an event loop
+        self.sink = sink
+
+    def deliver(self, item):
+        if self.sink is not None:
+            self.sink(item)
+        else:
+            self.queue.put(item)
+
+    def get(self, timeout = None):
+        return self.queue.get(timeout=timeout)
+
+    def ack(self, commandId):
+        with self.lock:
+            self.conn.execute("delete from commands where id = ?", (commandId,))
+            self.conn.commit()
+
+    def recover(self, maxAge = None, onExpired = None):
+        # commands older than maxAge seconds are acked as expired instead of replayed, a start from
+        # before a long outage would otherwise begin a session nobody asked for any more
+        cutoff = f"-{int(maxAge or 0)} seconds"
+        with self.lock:
+            rows = self.conn.execute("select id, payload, receivedAt < datetime('now', ?) from commands order by id", (cutoff,)).fetchall()
+        recovered = 0
+        for commandId, payload, expired in rows:
+            command = json.loads(payload)
+            if not expired or maxAge is None:
+                self.deliver((commandId, command))
+                recovered += 1
+                continue
+            self.ack(commandId)
+            logger.warning(f"Expired journaled command {commandId} received over {int(maxAge)}s ago")
+            if onExpired is not None:
+                try:
+                    onExpired(command)
+                except Exception as e:
+                    logger.error(f"Error acking expired command {commandId}: {e}")
+        if recovered:
+            logger.info(f"Recovered {recovered} unhandled commands from journal")
+        return recovered
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,80 @@
+import threading
+import queue
+import json
+import time
+import logging
+import traceback
+
+logger = logging.getLogger("sackBag_logger.publisher")
+
+
+class CounterPublisher:
+    """Publishes bay counters off the frame loop, only when they change or on the heartbeat."""
+    def __init__(self, client, topic = "sack/bag/counter", heartbeat = 30, statusTopic = None, statusInterval = 5, maxQueue = 1000):
+        self.client = client
+        self.topic = topic
+        self.heartbeat = heartbeat
+        self.statusTopic = statusTopic
+        self.statusInterval = statusInterval
+        self.lastSent = {}
+        self.status = {}
+        self.statusChanged = False
+        self.pending = {}
+        self.messages = queue.Queue(maxsize=maxQueue)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def update(self, bayNo, data):
+        now = time.monotonic()
+        last = self.lastSent.get(bayNo)
+        if last is not None and last[0] == data and now - last[1] < self.heartbeat:
+            return
+        self.lastSent[bayNo] = (dict(data), now)
+        with self.lock:
+            # a bay that updates faster than the broker drains only keeps its latest counts
+            self.pending[bayNo] = data
+            self.status[bayNo] = data
+            self.statusChanged = True
+        self.wakeup.set()
+
+    def publish(self, topic, payload):
+        try:
+            self.messages.put_nowait((topic, payload))
+            self.wakeup.set()
+        except queue.Full:
+            logger.error(f"Publish queue full, dropping message for {topic}")
+
+    def remove(self, bayNo):
+        self.lastSent.pop(bayNo, None)
+        with self.lock:
+            self.status.pop(bayNo, None)
+            self.statusChanged = True
+
+    def run(self):
+        lastStatus = time.monotonic()
+        while True:
+            self.wakeup.wait(timeout=self.statusInterval)
+            self.wakeup.clear()
+            try:
+                with self.lock:
+                    pending, self.pending = self.pending, {}
+                for bayNo, data in pending.items():
+                    self.client.publish(self.topic, json.dumps({"bayNo": bayNo, "data": data}))
+                while True:
+                    try:
+                        topic, payload = self.messages.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.client.publish(topic, payload)
+                if self.statusTopic and time.monotonic() - lastStatus >= self.statusInterval:
+                    with self.lock:
+                        status = dict(self.status) if self.statusChanged else None
+                        self.statusChanged = False
+                    if status is not None:
+                        self.client.publish(self.statusTopic, json.dumps({"bays": status}))
+                    lastStatus = time.monotonic()
+            except Exception:
+                logger.error("Error in CounterPublisher:\n" + traceback.format_exc())
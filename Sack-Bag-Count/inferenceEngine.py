@@ -0,0 +1,185 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+import numpy as np
+import torch
+from ultralytics import YOLO
+from ultralytics.engine.results import Boxes, Results
+from ultralytics.trackers.basetrack import BaseTrack
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
+
+logger = logging.getLogger("sackBag_logger.inference")
+
+
+class InferenceRequest:
+    def __init__(self, frame, imgsz):
+        self.frame = frame
+        self.imgsz = imgsz
+        self.submittedAt = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class TrackerPool:
+    """Keeps ByteTrack instances built ahead of time so a starting bay only has to borrow one."""
+    def __init__(self, trackerArgs, size = 4, frameRate = 30):
+        self.trackerArgs = trackerArgs
+        self.frameRate = frameRate
+        self.lock = threading.Lock()
+        self.idle = [self.create() for _ in range(max(0, int(size)))]
+
+    def create(self):
+        return BYTETracker(args=self.trackerArgs, frame_rate=self.frameRate)
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        logger.info("Tracker pool exhausted, building a new tracker")
+        return self.create()
+
+    def release(self, tracker):
+        # BYTETracker.reset() would also reset the track id counter shared by every bay
+        tracker.tracked_stracks = []
+        tracker.lost_stracks = []
+        tracker.removed_stracks = []
+        tracker.frame_id = 0
+        tracker.kalman_filter = tracker.get_kalmanfilter()
+        with self.lock:
+            self.idle.append(tracker)
+
+
+class InferenceEngine:
+    """Runs one shared detector for every bay, batching frames submitted within maxLatencyMs."""
+    def __init__(self, modelName, maxBatchSize = 8, maxLatencyMs = 20, imgsz = 640, conf = 0.2, iou = 0.4, tracker = "bytetrack.yaml", trackerPoolSize = 4):
+        self.model = YOLO(modelName)
+        self.maxBatchSize = max(1, int(maxBatchSize))
+        self.maxLatency = max(0, float(maxLatencyMs)) / 1000
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.trackerPool = TrackerPool(IterableSimpleNamespace(**yaml_load(check_yaml(tracker))), size = trackerPoolSize)
+        self.trackers = {}
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def warmup(self, frameWidth, frameHeight, imgszs = None):
+        frame = np.zeros((frameHeight, frameWidth, 3), dtype=np.uint8)
+        for imgsz in imgszs or [self.imgsz]:
+            startTime = time.monotonic()
+            self.detect(frame, imgsz = imgsz)
+            logger.info(f"Inference engine warmed up for imgsz {imgsz} in {(time.monotonic() - startTime) * 1000:.0f} ms")
+
+    def register(self, key):
+        tracker = self.trackerPool.acquire()
+        with self.lock:
+            previous = self.trackers.pop(key, None)
+            self.trackers[key] = tracker
+        if previous is not None:
+            self.trackerPool.release(previous)
+        return tracker
+
+    def unregister(self, key, tracker = None):
+        # with a tracker, only that registration is dropped; a pipeline stopping late leaves its replacement alone
+        with self.lock:
+            if tracker is not None and self.trackers.get(key) is not tracker:
+                return
+            tracker = self.trackers.pop(key, None)
+        if tracker is not None:
+            self.trackerPool.release(tracker)
+
+    def reserveTrackIds(self, lastId):
+        # track ids come from one process-wide counter, keep new ids clear of restored ones
+        BaseTrack._count = max(BaseTrack._count, int(lastId))
+
+    def detect(self, frame, imgsz = None, timeout = None, window = None):
+        if window is not None:
+            x1, y1, x2, y2 = window
+            request = InferenceRequest(np.ascontiguousarray(frame[y1:y2, x1:x2]), imgsz or self.imgsz)
+        else:
+            request = InferenceRequest(frame, imgsz or self.imgsz)
+        self.requests.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("Inference request timed out")
+        if request.error is not None:
+            raise request.error
+        if window is not None:
+            return self.toFrameCoordinates(request.result, frame, window)
+        return request.result
+
+    def toFrameCoordinates(self, result, frame, window):
+        boxes = result.boxes.data.clone()
+        boxes[:, [0, 2]] += window[0]
+        boxes[:, [1, 3]] += window[1]
+        return Results(frame, path = result.path, names = result.names, boxes = boxes)
+
+    def track(self, key, frame, imgsz = None, timeout = None, window = None):
+        # detection is batched across cameras, the tracker update runs on the calling camera pipeline thread
+        result = self.detect(frame, imgsz = imgsz, timeout = timeout, window = window)
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            raise KeyError(f"No tracker registered for {key}")
+        det = result.boxes.cpu().numpy()
+        tracks = tracker.update(det, result.orig_img)
+        if len(tracks) == 0:
+            return [result]
+        idx = tracks[:, -1].astype(int)
+        result = result[idx]
+        result.update(boxes=torch.as_tensor(tracks[:, :-1]))
+        return [result]
+
+    def skip(self, key, frame):
+        # ages the bay tracker without running detection, so lost tracks still expire on schedule
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            raise KeyError(f"No tracker registered for {key}")
+        tracker.update(Boxes(np.empty((0, 6), dtype=np.float32), frame.shape[:2]), frame)
+        return [Results(frame, path = "", names = self.model.names, boxes = torch.empty((0, 6)))]
+
+    def run(self):
+        while not self.stopped:
+            try:
+                first = self.requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = first.submittedAt + self.maxLatency
+            while len(batch) < self.maxBatchSize:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.runBatch(batch)
+
+    def runBatch(self, batch):
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.imgsz, []).append(request)
+        for imgsz, requests in groups.items():
+            try:
+                results = self.model.predict([request.frame for request in requests], imgsz = imgsz, conf = self.conf, iou = self.iou, verbose = False)
+                for request, result in zip(requests, results):
+                    request.result = result
+            except Exception as e:
+                logger.error("Error in InferenceEngine batch:\n" + traceback.format_exc())
+                for request in requests:
+                    request.error = e
+            finally:
+                for request in requests:
+                    request.done.set()
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join(timeout=5)
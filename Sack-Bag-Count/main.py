@@ -1,10 +1,15 @@
 import sackBagCount
+import inferenceEngine
+import cameraPipeline
+import bayCheckpoint
+import counterPublisher
+import mqtt
+import asyncio
 import logging
 import os
 import threading
 import utilities
 import configparser
-import queue
 import time
 import json
 from pathlib import Path
@@ -20,23 +25,15 @@ if os.path.exists(config_path):
 # Logger setup
 log_filename = "sackBagCount.log"
 log_filepath = os.path.join(os.getcwd(), log_filename)
-logger = logging.getLogger("sackBag_logger")
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    file_mode = "a" if os.path.exists(log_filepath) else "w"
-    file_handler = logging.FileHandler(log_filepath, mode=file_mode)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-
-# MQTT Message Handler
-def on_message(client, userdata, message):
-    queue_data.put(message.payload.decode("utf-8"))
-
-queue_data = queue.Queue()
+logger = utilities.setupLogging("sackBag_logger", log_filepath, config["Logging"], shared = True)
 
 thr = {}
 stopEvents = {}
+engine = None
+# created at startup, sackBagCount imports this module and must not open a second store
+checkpoints = None
+publisher = None
+startedAt = time.monotonic()
   
 table = '''CREATE TABLE IF NOT EXISTS sackBag_Analytics (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -60,78 +57,48 @@ table = '''CREATE TABLE IF NOT EXISTS sackBag_Analytics (
             
 
 ftpInfo =  config["FTP"]
+countingConfig = config["Counting"]
+inferenceConfig = config["Inference"]
+uploadInfo = config["Upload"]
+drainInfo = config["Drain"]
 sackAnalyticsUrl =  config["URLS"]["sackAnalytics"]
 bayInfoUrl = config["URLS"]["getBayDetails"]
 imageFolderName = f"sack_data/sack_bag_frames/"
 
+def rowToApiData(data):
+    return {
+        "company_code": data[1],
+        "store_code": data[2],
+        "bay_code": data[3],
+        "loading_count": data[4],
+        "unloading_count": data[5],               
+        "no_of_counts": data[6],
+        "vehicle_number": data[7],
+        "is_count_incorrect": data[8],
+        "first_frame": data[9],
+        "last_frame": data[10],
+        "counting_start_time": data[11],
+        "counting_end_time": data[12],
+        "is_alert_triggered": data[13],
+        "alert_reason": data[14]
+    }
+
 def sendPreviousDataOnCloud(ftpInfo, ftpFolder, imageFolderName, table = None, url = None):
     try:
-        ftp = utilities.setupFtp(ftpInfo.get("username"), ftpInfo.get("password"), ftpInfo.get("host"), int(ftpInfo.get("port")))
-        if not ftp:
-            logger.error("FTP connection failed")
-            return
-        
-        if os.path.exists(imageFolderName):
-            for compSubfolder in os.listdir(imageFolderName):
-                compSubfolderPath = os.path.join(imageFolderName, compSubfolder)
-                for storeSubFolder in os.listdir(compSubfolderPath):
-                    storeSubfolderPath = os.path.join(compSubfolderPath, storeSubFolder)
-                    for baySubFolder in os.listdir(storeSubfolderPath):
-                        baySubfolderPath = os.path.join(storeSubfolderPath, baySubFolder)
-                        images = [file for file in os.listdir(baySubfolderPath) if file.endswith(('.jpg'))]
-                        ftp.ftp_mkdir_recursive(os.path.join(ftpFolder, compSubfolder, storeSubFolder, baySubFolder))
-                        for image in images:
-                            ftpImageLocation  = f"{ftpFolder}/{compSubfolder}/{storeSubFolder}/{baySubFolder}/{image}"
-                            frame  = cv2.imread(os.path.join(baySubfolderPath, image))
-                            ftpres = utilities.uploadFileOnFtp(ftp, frame, ftpImageLocation)
-                            if ftpres:
-                                os.remove(os.path.join(baySubfolderPath, image))
-                            else:
-                                if ftp is not None:
-                                    ftp.close()
-                                ftp.connect()
-                        if not os.listdir(baySubfolderPath):
-                            os.rmdir(baySubfolderPath)
-                    if not os.listdir(storeSubfolderPath):
-                        os.rmdir(storeSubfolderPath)
-                if not os.listdir(compSubfolderPath):
-                    os.rmdir(compSubfolderPath)
+        ftpPool = utilities.getFtpPool(ftpInfo)
+        limiter = utilities.getDrainLimiter(drainInfo)
+        workers = drainInfo.getint("workers", 4)
         
-        if ftp is not None:
-            ftp.close()    
+        # spooled images are the jpg bytes encoded at event time, streamed back from disk as they are
+        spool = utilities.getImageSpool(imageFolderName)
+        sent = spool.drain(lambda path, relPath: ftpPool.uploadFile(path, f"{ftpFolder}/{relPath}"), workers = workers, limiter = limiter)
+        if sent:
+            logger.info(f"Uploaded {sent} spooled images")
             
-        try:
-            conn = utilities.setupDB(table)
-        except Exception as e:
-            logger.error(f"Error in setupDB: {e}")
-            
-        if conn:
-            cusor = conn.cursor
-            cusor.execute('''select * from sackBag_Analytics''')
-            allPreviousData = cusor.fetchall()
-            if allPreviousData:
-                for data in allPreviousData:
-                    apiData = {
-                        "company_code": data[1],
-                        "store_code": data[2],
-                        "bay_code": data[3],
-                        "loading_count": data[4],
-                        "unloading_count": data[5],               
-                        "no_of_counts": data[6],
-                        "vehicle_number": data[7],
-                        "is_count_incorrect": data[8],
-                        "first_frame": data[9],
-                        "last_frame": data[10],
-                        "counting_start_time": data[11],
-                        "counting_end_time": data[12],
-                        "is_alert_triggered": data[13],
-                        "alert_reason": data[14]
-                    }
-                    res = utilities.sendRequest(url, apiData)
-                    if res.get("status") ==  200:
-                        cusor.execute('''delete from sackBag_Analytics where id = ?''', (data[0],))
-                        conn.commit()
-            conn.close()
+        sent = utilities.drainOutbox(utilities.getOutbox(table), "sackBag_Analytics", rowToApiData, url,
+                                     pageSize = drainInfo.getint("page_size", 200), workers = workers, limiter = limiter)
+        if sent:
+            logger.info(f"Sent {sent} backlog records")
                 
     except Exception as e:
         logger.error("Error in sendPreviousDataOnCloud:\n" + traceback.format_exc())
@@ -141,6 +108,7 @@ def sendPreviousDataOnCloud(ftpInfo, ftpFolder, imageFolderName, table = None, u
 
 def countSackBags(bayDetails):
     try:
+        commandTime = time.monotonic()
         stopEvent = threading.Event()
         bayNo = bayDetails.get("bayNo")
         frameWidth = 960
@@ -153,15 +121,23 @@ def countSackBags(bayDetails):
             data = res.get("data")
             rtsp = data.get("rtsp_url")
             direction = data.get("loading_direction")
-            modelName = "1207_50ep.pt"
+            modelName = inferenceConfig.get("model", "1207_50ep.pt")
 
             loi = data.get("loi")
             roi = data.get("roi")
+
+            # bays whose cameras share an rtsp url share one capture and detection pipeline
+            pipeline = None
+            if rtsp and loi is not None:
+                if rtsp in cameraPipeline.pipelines:
+                    logger.info(f"Bay {bayNo} shares camera {rtsp} with a running bay")
+                pipeline = cameraPipeline.attachBay(rtsp, bayNo, roi, loi, engine, frameWidth, frameHeight, inferenceConfig = inferenceConfig, countingConfig = countingConfig,
+                                                    publisher = publisher, stateTopic = config["MQTT"].get("camera_state_topic", "sack/bag/camera"))
             
             t = threading.Thread(
                 target=sackBagCount.sackBagCount,
                 args=(bayDetails, rtsp, direction, frameWidth, frameHeight, modelName, stopEvent, ftpInfo, sackAnalyticsUrl),
-                kwargs={"loi": loi, "roi": roi, "client": client, "table" :table}
+                kwargs={"loi": loi, "roi": roi, "client": client, "table" :table, "engine": engine, "commandTime": commandTime, "countingConfig": countingConfig, "inferenceConfig": inferenceConfig, "pipeline": pipeline, "checkpoints": checkpoints, "publisher": publisher}
             )
             thr[bayNo] = t
             stopEvents[bayNo] = stopEvent
@@ -178,7 +154,8 @@ def close(bayNo):
         thread = thr.get(bayNo)
         stop_event = stopEvents.get(bayNo)
 
-        if thread and thread.is_alive():
+        # a bay thread closing itself after an error only drops its entry, it cannot join itself
+        if thread and thread.is_alive() and thread is not threading.current_thread():
             if stop_event:
                 stop_event.set()
             thread.join(timeout=5)
@@ -191,84 +168,140 @@ def close(bayNo):
     except Exception as e:
         logger.error(f"Error in close: {e}")
 
-def read_json_file(filepath):
-    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
-        with open(filepath, "w") as f:
-            json.dump({"start": [], "stop": []}, f, indent=4)
-    with open(filepath, "r") as f:
-        return json.load(f)
-
-def startCounting():
-    filepath = os.path.join(os.getcwd(), "mqtt.json")
-    while True:
-        try:
-            data = read_json_file(filepath)
-            for bayDetail in data.get("start", []):
-                bayNo = bayDetail.get("bayNo")
-                if bayDetail.get("isCheck") == 1 and bayNo in thr:
-                    client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "already running", "statusCode": 201}))
-                elif bayDetail.get("isCheck") == 1 and bayNo not in thr:
-                    client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "Not running", "statusCode": 202}))
-                elif bayNo not in thr and bayDetail.get("isCheck") == 0:
-                    countSackBags(bayDetail)
-                else:
-                    client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "already running", "statusCode": 201}))
+def isRunning(bayNo):
+    # a bay thread that died on its own is dropped here, so a restart is not rejected as already running
+    thread = thr.get(bayNo)
+    if thread is not None and not thread.is_alive():
+        logger.error(f"Thread for bay {bayNo} exited without a stop command")
+        thr.pop(bayNo, None)
+        stopEvents.pop(bayNo, None)
+        return False
+    return thread is not None
 
-                data["start"] = [entry for entry in data.get("start", []) if entry.get("bayNo") != bayNo]
-                utilities.saveDataInJson(filepath, data)
+def startBay(bayDetail):
+    bayNo = bayDetail.get("bayNo")
+    running = isRunning(bayNo)
+    if bayDetail.get("isCheck") == 1 and running:
+        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "already running", "statusCode": 201}))
+    elif bayDetail.get("isCheck") == 1 and not running:
+        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "Not running", "statusCode": 202}))
+    elif not running and bayDetail.get("isCheck") == 0:
+        countSackBags(bayDetail)
+    else:
+        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "already running", "statusCode": 201}))
 
-            time.sleep(1)
+def stopBay(bayDetail):
+    bayNo = bayDetail.get("bayNo")
+    running = isRunning(bayNo)
+    if bayDetail.get("isCheck") == 1 and not running:
+        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "not running", "statusCode": 202})) 
+    elif bayDetail.get("isCheck") == 1 and running:
+        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "already running", "statusCode": 201}))  
+    elif running and bayDetail.get("isCheck") == 0:
+        close(bayNo)
+    else:
+        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "not running", "statusCode": 202}))
 
+async def handleCommand(bayLock, commandId, command):
+    # commands for one bay run in arrival order, bay api calls and thread joins stay off the event loop
+    async with bayLock:
+        try:
+            if command.get("status") == "start":
+                await asyncio.to_thread(startBay, command)
+            else:
+                await asyncio.to_thread(stopBay, command)
         except Exception as e:
-            logger.error(f"Error in startCounting: {e}")
-            time.sleep(1)
+            logger.error(f"Error in processCommands: {e}")
+        finally:
+            await asyncio.to_thread(mqtt.commands.ack, commandId)
 
-def stopCounting():
-    filepath = os.path.join(os.getcwd(), "mqtt.json")
+async def processCommands(pending):
+    bayLocks = {}
+    tasks = set()
     while True:
-        try:
-            data = read_json_file(filepath)
-            for bayDetail in data.get("stop", []):
-                bayNo = bayDetail.get("bayNo")
-                if bayDetail.get("isCheck") == 1 and bayNo not in thr:
-                    client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "not running", "statusCode": 202})) 
-                elif bayDetail.get("isCheck") == 1 and bayNo in thr:
-                    client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "already running", "statusCode": 201}))  
-                elif bayNo in thr and bayDetail.get("isCheck") == 0:
-                    close(bayNo)
-                else:
-                    client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "not running", "statusCode": 202}))
+        commandId, command = await pending.get()
+        bayLock = bayLocks.setdefault(command.get("bayNo"), asyncio.Lock())
+        task = asyncio.create_task(handleCommand(bayLock, commandId, command))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
 
-                # Clean up the stop entry
-                data["stop"] = [entry for entry in data.get("stop", []) if entry.get("bayNo") != bayNo]
-                utilities.saveDataInJson(filepath, data)
+async def cloudSync(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(sendPreviousDataOnCloud, ftpInfo, ftpInfo.get("ftp_location"), imageFolderName, table=table, url=sackAnalyticsUrl)
+        except Exception as e:
+            logger.error(f"Error in cloudSync: {e}")
 
-            time.sleep(1)
+async def publishMetrics(interval, uploadExecutor):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            publisher.publish("sack/bag/metrics", json.dumps({"uploads": uploadExecutor.stats(), "bandwidth": utilities.getBandwidthGovernor().stats(), "evidence": utilities.evidenceStats()}))
+        except Exception as e:
+            logger.error(f"Error in publishMetrics: {e}")
 
+async def healthHeartbeat(interval, topic):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for bayNo in list(thr):
+                isRunning(bayNo)
+            cameras = [{"bays": list(pipeline.bays), "state": pipeline.capture.state} for pipeline in list(cameraPipeline.pipelines.values())]
+            publisher.publish(topic, json.dumps({"bays": list(thr), "cameras": cameras, "uptime": int(time.monotonic() - startedAt)}))
         except Exception as e:
-            logger.error(f"Error in stopCounting: {e}")
-            time.sleep(1)
+            logger.error(f"Error in healthHeartbeat: {e}")
 
-# === MAIN EXECUTION ===
-if __name__ == "__main__":
-    mqtt = config["MQTT"]
-    client = utilities.MQTTClient(client_id=mqtt["clientId"], broker = mqtt["broker"], on_message=on_message, transport=mqtt["transport"])
+async def control(mqttInfo):
+    global publisher
+    loop = asyncio.get_running_loop()
+    pending = asyncio.Queue()
+    # the paho network thread journals each command and wakes the loop, nothing polls
+    mqtt.commands.setSink(lambda item: loop.call_soon_threadsafe(pending.put_nowait, item))
     client.connect()
     client.loop_start()
+    # recovered after connecting, so the expired acks reach the broker
+    mqtt.commands.recover(
+        maxAge = mqttInfo.getfloat("command_max_age_seconds", 300),
+        onExpired = lambda command: client.publish("sack/bag/ack", json.dumps({"bayNo": command.get("bayNo"), "status": "expired", "statusCode": 408}))
+    )
+    publisher = counterPublisher.CounterPublisher(
+        client,
+        heartbeat = mqttInfo.getfloat("counter_heartbeat_seconds", 30),
+        statusTopic = mqttInfo.get("status_topic") or None,
+        statusInterval = mqttInfo.getfloat("status_interval_seconds", 5)
+    )
+    uploadExecutor = utilities.getUploadExecutor(uploadInfo)
+    await asyncio.gather(
+        processCommands(pending),
+        cloudSync(drainInfo.getint("sync_interval_seconds", 600)),
+        publishMetrics(uploadInfo.getint("stats_interval_seconds", 60), uploadExecutor),
+        healthHeartbeat(mqttInfo.getfloat("health_interval_seconds", 30), mqttInfo.get("health_topic", "sack/bag/health"))
+    )
+
+# === MAIN EXECUTION ===
+if __name__ == "__main__":
+    mqttInfo = config["MQTT"]
+    utilities.getHttpClient(config["HTTP"])
+    utilities.getBandwidthGovernor(config["Bandwidth"])
+    utilities.configureEvidenceProfiles(config)
+    client = utilities.MQTTClient(client_id=mqttInfo["clientId"], broker = mqttInfo["broker"], port = int(mqttInfo.get("port", 1883)), topic = mqttInfo.get("topic", "sack/bag/status"), on_message=mqtt.on_message, transport=mqttInfo["transport"])
+
+    checkpoints = bayCheckpoint.BayCheckpointStore()
+    engine = inferenceEngine.InferenceEngine(
+        inferenceConfig.get("model", "1207_50ep.pt"),
+        maxBatchSize = inferenceConfig.getint("max_batch_size", 8),
+        maxLatencyMs = inferenceConfig.getfloat("max_latency_ms", 20),
+        imgsz = inferenceConfig.getint("imgsz", 640),
+        trackerPoolSize = inferenceConfig.getint("tracker_pool_size", 4)
+    )
+    warmupSizes = [engine.imgsz]
+    if inferenceConfig.getboolean("crop_inference", False):
+        warmupSizes.append(inferenceConfig.getint("crop_imgsz", 320))
+    engine.warmup(960, 640, imgszs = warmupSizes)
 
-    threading.Thread(target=startCounting, daemon=True).start()
-    threading.Thread(target=stopCounting, daemon=True).start()
-    syncTime = int(time.time())
-    
     try:
-        while True:
-            try:
-                if int(time.time()) - syncTime > 600:
-                    sendPreviousDataOnCloud(ftpInfo, ftpInfo.get("ftp_location"), imageFolderName, table=table, url=sackAnalyticsUrl)
-                    syncTime = int(time.time())
-            except Exception as e:
-                continue
-            time.sleep(1)
+        asyncio.run(control(mqttInfo))
     except KeyboardInterrupt:
         logger.info("Shutting down MQTT client...")
         client.loop_stop()
@@ -0,0 +1,47 @@
+class MotionGate:
+    """Frame-difference gate on the downscaled bay window, used to skip detection while nothing moves."""
+    def __init__(self, window = None, scale = 0.25, threshold = 0.01, pixelDelta = 25, wakeFrames = 25, minDutyCycle = 0.1, learningRate = 0.05):
+        self.window = window
+        self.scale = scale
+        self.threshold = threshold
+        self.pixelDelta = pixelDelta
+        self.wakeFrames = wakeFrames
+        self.maxGatedFrames = int(1 / minDutyCycle) - 1 if minDutyCycle > 0 else None
+        self.learningRate = learningRate
+        self.background = None
+        self.awake = 0
+        self.gatedInRow = 0
+        self.frames = 0
+        self.gatedFrames = 0
+
+    def motion(self, frame):
+        # imported here, the gating in check() needs no cv2 and is tested without it
+        import cv2
+        if self.window is not None:
+            x1, y1, x2, y2 = self.window
+            frame = frame[y1:y2, x1:x2]
+        small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self.background is None:
+            self.background = gray.astype("float32")
+            return 1.0
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(gray, self.background, self.learningRate)
+        _, mask = cv2.threshold(diff, self.pixelDelta, 255, cv2.THRESH_BINARY)
+        return cv2.countNonZero(mask) / mask.size
+
+    def check(self, frame):
+        self.frames += 1
+        if self.motion(frame) >= self.threshold:
+            self.awake = self.wakeFrames
+        if self.awake > 0:
+            self.awake -= 1
+        elif self.maxGatedFrames is None or self.gatedInRow < self.maxGatedFrames:
+            self.gatedInRow += 1
+            self.gatedFrames += 1
+            return False
+        self.gatedInRow = 0
+        return True
+
+    def gatedFraction(self):
+        return self.gatedFrames / self.frames if self.frames else 0.0
@@ -1,32 +1,20 @@
-import paho.mqtt.client as mqtt
-from paho.mqtt.client import CallbackAPIVersion
-import threading
-from pathlib import Path
 import json
 import os
 import logging
-import queue
-import time 
 import configparser
+import commandQueue
 import utilities
 
-log_filename = f"sackMqttt.log"
-log_filepath = os.path.join(os.getcwd(), log_filename)
-logger = logging.getLogger('sackBMqtt_logger')
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    file_mode = 'a' if os.path.exists(log_filepath) else 'w'
-    file_handler = logging.FileHandler(log_filepath, mode=file_mode)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-
 config = configparser.ConfigParser()
 config_path = os.path.join(os.getcwd(), "config.ini")
 if os.path.exists(config_path):
     config.read(config_path)
 
-queue_data = queue.Queue()
+log_filename = f"sackMqttt.log"
+log_filepath = os.path.join(os.getcwd(), log_filename)
+logger = utilities.setupLogging('sackBMqtt_logger', log_filepath, config["Logging"])
+
+commands = commandQueue.CommandQueue(os.path.join(os.getcwd(), "commands.db"))
 
 # class MQTTClient:
 #     def __init__(self, client_id, broker= "localhost", port=1883, keepalive=60, topic = None, on_message=None, transport="tcp"):
@@ -121,70 +109,11 @@ queue_data = queue.Queue()
 #         self.client.on_connect = callback
 
 
-def saveDataInJson(fileName,data):
-    try:
-
-        if not fileName.endswith(".json"):
-            return
-        
-        if not data:
-            return
-        
-        file_path = Path(fileName)
-        temp_path = file_path.with_suffix('.tmp')
-        while True:
-            try:
-                with open(temp_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-                    f.flush()
-                    os.fsync(f.fileno())
-                
-                os.replace(temp_path, file_path)
-                break
-            except Exception as e:
-                continue
-        return
-    except Exception as e:
-        return
-    
 def on_message(client, userdata, message):
     try:
-    # queue_data.put(message.payload.decode('utf-8'))
-        print(f"Received message: {message.payload.decode('utf-8')} on topic: {message.topic}")
-        message = json.loads(message.payload.decode('utf-8'))
-        if message:
-            filePath = os.path.join(os.getcwd(), "mqtt.json")
-            if not os.path.exists(filePath):
-                with open(filePath, "w") as f:
-                    json.dump({"start": [], "stop": []}, f, indent=4)
-            with open(filePath, "r") as f:
-                data = json.load(f)
-                
-            data.setdefault("start", [])
-            data.setdefault("stop", [])
-            
-            if message.get("status") == "start":
-                data["start"].append(message) 
-            else:
-                data["stop"].append(message)
-            saveDataInJson(filePath, data)   
+        command = json.loads(message.payload.decode('utf-8'))
+        if command:
+            commands.put(command)
     except Exception as e:
         logger.error(f"Error in on_message: {e}")
         return
-            
-
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    mqttInfo  = config["MQTT"]
-    client = utilities.MQTTClient(client_id="picker",broker = mqttInfo.get("broker"), topic="sack/bag/status", port = int(mqttInfo.get("port")), on_message=on_message, transport=mqttInfo.get("transport"))
-    
-    client.connect()
-    client.loop_start()
-    
-    # Keep the script running to listen for messages
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        client.loop_stop()
-        print("Exiting...")
\ No newline at end of file
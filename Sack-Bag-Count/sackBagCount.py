@@ -3,8 +3,10 @@ import configparser
 import os
 import logging
 from sackExceptions import sackExceptions 
+from trackRegistry import TrackRegistry
+import cameraPipeline
 import time
-from ultralytics import YOLO
+from inferenceEngine import InferenceEngine
 import cv2
 import json
 from datetime import datetime
@@ -17,46 +19,28 @@ config_path = os.path.join(os.getcwd() ,"Sack-Bag-Count","config.ini")
 config =  configparser.ConfigParser()
 config.read(config_path)
 logger = logging.getLogger("sackBag_logger")
+spoolFolderName = "sack_data/sack_bag_frames"
 
 
-def countSacks(objectsCoordinates, uncrossedLineSacks, crossedLineSacks, direction, point1, point2):
+def countSacks(objectsCoordinates, registry, crosses = None):
     try:
-        for id in objectsCoordinates.keys():
-            if utilities.point_position(point1, point2, objectsCoordinates.get(id)) != direction:
-                if id in uncrossedLineSacks["loading"]:
-                    crossedLineSacks["loading"].append(id)
-                    uncrossedLineSacks["loading"].remove(id)
-                else:
-                    if id not in uncrossedLineSacks["unLoading"]:
-                        uncrossedLineSacks["unLoading"].append(id)
-                    if id in crossedLineSacks["unLoading"]:
-                        crossedLineSacks["unLoading"].remove(id)
-            else:
-                if id in uncrossedLineSacks["unLoading"]:
-                    uncrossedLineSacks["unLoading"].remove(id)
-                    crossedLineSacks["unLoading"].append(id)
-                else:
-                    if id not in uncrossedLineSacks["loading"]:
-                        uncrossedLineSacks["loading"].append(id)
-                    if id in crossedLineSacks["loading"]:
-                        crossedLineSacks["loading"].remove(id)  
-                # crossedLineSacks.append(id)
+        registry.update(objectsCoordinates, crosses)
     except Exception as e:
         logger.error(f"Error in countSacks: {e}")
         return None
     
-def saveDataInLocalDB(conn, data, startTime, isClosed, triggerAlert = 0):
-    try:
-        if not conn:
-            logger.error("Connection is None")
-            return
-        cursor = conn.cursor
+def saveDataInLocalDB(outbox, data, startTime, isClosed, triggerAlert = 0):
+    # runs on the outbox writer thread, so the lookup and the write share one transaction
+    def write(cursor):
         cursor.execute('''select id from sackBag_Analytics where companyCode = ? and storeCode = ? and bayCode = ? and countingStartTime = ?''',(data.get("company_code"), data.get("store_code"), data.get("bay_code"), startTime))
         res = cursor.fetchone()
+        if res and not isClosed and not triggerAlert:
+            # the start record is already there, possibly closed; it must not overwrite the counts with NULLs
+            return
         if res:
             if not triggerAlert:
                 cursor.execute('''update sackBag_Analytics set loadingCount = ?, unloadingCount = ?, lastFrameFilepath = ?, countingEndTime = ? where id = ?''',
-                            (data.get("loading_count"), data.get("unloading_count"), data.get("last_frame"), startTime, res[0]))
+                            (data.get("loading_count"), data.get("unloading_count"), data.get("last_frame"), data.get("counting_end_time"), res[0]))
             else:
                 cursor.execute('''update sackBag_Analytics set isAlertTriggerd = ?, alertReason = ? where id = ?''',
                             (data.get("is_alert_triggered"), data.get("alert_reason"), res[0]))
@@ -64,47 +48,48 @@ def saveDataInLocalDB(conn, data, startTime, isClosed, triggerAlert = 0):
             cursor.execute('''insert into sackBag_Analytics (companyCode, storeCode, bayCode, loadingCount, unLoadingCount, lastFrameFilepath, countingEndTime, countingStartTime) values (?, ?, ?, ?, ?, ?, ?, ?)''',
                          (data.get("company_code"), data.get("store_code"), data.get("bay_code"), data.get("loading_count"), data.get("unloading_count"), data.get("last_frame"), data.get("counting_end_time"), startTime))
         elif triggerAlert:
-            cursor.execute('''insert into sackBag_Analytics (companyCode, storeCode, bayCode, isAlertTriggerd = ?, alertReason = ?, countingStartTime = ?) values (?, ?, ?, ?, ?, ?)''',
+            cursor.execute('''insert into sackBag_Analytics (companyCode, storeCode, bayCode, isAlertTriggerd, alertReason, countingStartTime) values (?, ?, ?, ?, ?, ?)''',
                          (data.get("company_code"), data.get("store_code"), data.get("bay_code"),data.get("is_alert_triggered"), data.get("alert_reason"), startTime))
         else:
             cursor.execute('''insert into sackBag_Analytics (companyCode, storeCode, bayCode, noOfCounts, vehicleNumber, firstFrameFilepath, countingStartTime) values (?, ?, ?, ?, ?, ?, ?)''',
                          (data.get("company_code"), data.get("store_code"), data.get("bay_code"), data.get("no_of_counts"), data.get("vehicle_number"), data.get("first_frame"), startTime))
-        conn.commit()
+    try:
+        outbox.submit(write)
     except Exception as e:
         logger.error(f"Error in saveDataInLocalDB: {e}")
-    finally:
-        if conn:
-            conn.close()
     
 def uploadDataOnCloud(
     ftpInfo, folderName, imageName, frame, imageFolderName, 
     bayDetail,  isClosed = False, table = None, 
     loadingCount = 0, unLoadingCount = 0, isCountIncorrect = False,
     url = None, triggerAlert = 0, startTime = datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-    alertReason  = "Count limit exceeded"
+    alertReason  = "Count limit exceeded", spool = False,
+    profile = None, region = None, regionSize = None, snapshot = None, sendData = True
     ):
     try:
         fileName = f"{folderName}/{imageName}"
+        if snapshot is not None and not spool:
+            # taken here on the upload worker, a main stream still can take a second to open; a spooled job
+            # runs on the caller's thread when the queue is full, so it keeps the frame already captured
+            still = snapshot()
+            if still is not None:
+                frame = still
         if frame is not None:
-            ftp = None
-            try:
-                ftp = utilities.setupFtp(ftpInfo.get("username"), ftpInfo.get("password"), ftpInfo.get("host"), int(ftpInfo.get("port")))
-            except Exception as e:
-                logger.error(f"Error setting up FTP: {e}")
-            ftpRes = utilities.uploadFileOnFtp(ftp, frame, fileName)
-            if not ftpRes:
-                logger.error("Error in uploadFileOnFtp")
-                if not os.path.exists(imageFolderName):
-                    os.makedirs(imageFolderName)
-                imagePath = f"{imageFolderName}/{imageName}"
-                success = cv2.imwrite(imagePath, frame)
-                if success:
-                    logger.error(f"Image saved to {imagePath}")
-                else:
-                    logger.error(f"Failed to save image to {imagePath}")
+            # encoded once here through the evidence profile, the spool keeps these exact bytes for the retry
+            if profile:
+                imageBytes = utilities.getEvidenceProfile(profile).encode(frame, region, regionSize)
+            else:
+                imageBytes = utilities.encodeJpeg(frame)
+            ftpRes = imageBytes is not None and not spool and utilities.getFtpPool(ftpInfo).uploadBytes(imageBytes, fileName)
+            if not ftpRes and imageBytes is not None:
+                if not spool:
+                    logger.error(f"FTP pool upload of {fileName} failed, spooling the image")
+                spoolRelPath = os.path.relpath(f"{imageFolderName}/{imageName}", spoolFolderName)
+                utilities.getImageSpool(spoolFolderName).put(spoolRelPath, imageBytes)
+        if not sendData:
+            # an image only job, its record goes in a separate job
+            return
 
-            if ftp is not None:
-                ftp.close()
         if not isClosed and triggerAlert:
             apiData = {
                         "company_code": bayDetail.get("companyCode"),
@@ -137,20 +122,22 @@ def uploadDataOnCloud(
                 "counting_end_time": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
             }
         
-        res = utilities.sendRequest(url, apiData)
+        res = {} if spool else utilities.sendRequest(url, apiData)
         if res.get("status") != 200:
-            try:
-                conn = utilities.setupDB(table)
-            except Exception as e:
-                logger.error(f"Error in setupDB: {e}")
-            saveDataInLocalDB(conn, apiData, startTime, isClosed, triggerAlert= triggerAlert)
+            saveDataInLocalDB(utilities.getOutbox(table), apiData, startTime, isClosed, triggerAlert= triggerAlert)
             
     except Exception as e:
         logger.error(f"Error uploading data on cloud:" + traceback.format_exc())
         return None
     return
 
-def sackBagCount(bayDetails, rtsp, direction, frameWidth, frameHeight,modelName, stopEvent,ftpInfo , sackAnalyticsUrl, loi=None, roi=None, client = None, table = None):
+def submitUpload(priority, args, kwargs):
+    # when the upload queue is full the job is written to the local spool for sendPreviousDataOnCloud
+    utilities.getUploadExecutor().submit(priority, uploadDataOnCloud, args, kwargs,
+                                         spool = lambda: uploadDataOnCloud(*args, spool = True, **kwargs))
+
+def sackBagCount(bayDetails, rtsp, direction, frameWidth, frameHeight,modelName, stopEvent,ftpInfo , sackAnalyticsUrl, loi=None, roi=None, client = None, table = None, engine = None, commandTime = None, countingConfig = None, inferenceConfig = None, pipeline = None, checkpoints = None, publisher = None):
+    ownsEngine = False
     try:
         logger.info("starting sackBagCount thread")
         
@@ -166,62 +153,100 @@ def sackBagCount(bayDetails, rtsp, direction, frameWidth, frameHeight,modelName,
         if not os.path.exists("sack_data"):
             os.makedirs("sack_data")
         
-        imageFolderName = f"sack_data/sack_bag_frames/{companyCode}/{storeCode}/{bayNo}"
+        imageFolderName = f"{spoolFolderName}/{companyCode}/{storeCode}/{bayNo}"
         if not os.path.exists(imageFolderName):
             os.makedirs(imageFolderName)
         
         ftpFolder = f"{ftpInfo.get('ftp_location')}/{companyCode}/{storeCode}/{bayNo}"
         
-        try:
-            ftp = utilities.setupFtp(ftpInfo.get("username"), ftpInfo.get("password"), ftpInfo.get("host"), int(ftpInfo.get("port")))
-            ftp.ftp_mkdir_recursive(ftpFolder)
-        except Exception as e:
-            logger.error(f"Error setting up FTP: {e}")
-            
-        if rtsp:
-            cap = cv2.VideoCapture(rtsp)
-            while True:
-                ret, frame = cap.read()
-                if not ret or frame is None:
-                    logger.error("Failed to connect to RTSP stream, retrying...")
-                    time.sleep(1)
-                    cap = cv2.VideoCapture(rtsp)
-                    continue
-                else:
-                    try:
-                        imageName = f"first_frame_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                        threading.Thread(target = uploadDataOnCloud, args = (ftpInfo, ftpFolder, imageName, frame, imageFolderName, 
-                            bayDetails), kwargs = {"table": table, "url" : sackAnalyticsUrl,
-                            "startTime" : startTime} ).start()
-                        
-                        # uploadDataOnCloud(
-                        #     ftpInfo, ftpFolder, imageName, frame, imageFolderName, 
-                        #     bayDetails, table = table, url = sackAnalyticsUrl,
-                        #     startTime= startTime
-                        # )
-                        break
-                        
-                    except Exception as e:
-                        logger.error(f"Error setting up FTP: {e}")
-                        return None
-                    
-        else:
+        if not rtsp:
             raise sackExceptions(code = "SC-001", message = "RTSP stream not provided")
+        if loi is None:
+            raise sackExceptions(code = "SC-003", message = "Line of Interest (loi) not provided")
         
-        if modelName:
-            model = YOLO(modelName)
-        else:
-            raise sackExceptions(code = "SC-002", message = "Model name not provided")
+        ownsEngine = engine is None
+        if ownsEngine:
+            if modelName:
+                engine = InferenceEngine(modelName, maxBatchSize = 1)
+            else:
+                raise sackExceptions(code = "SC-002", message = "Model name not provided")
+        # evidence crops are taken around the roi and loi, in analysis coordinates
+        evidenceRegion = utilities.inferenceWindow(roi, loi, 0, frameWidth, frameHeight)
+        if pipeline is None:
+            pipeline = cameraPipeline.attachBay(rtsp, bayNo, roi, loi, engine, frameWidth, frameHeight, inferenceConfig = inferenceConfig, countingConfig = countingConfig, publisher = publisher,
+                                                ownsEngine = ownsEngine)
+            # the pipeline now owns the engine and stops it when its last bay detaches; an engine made for a camera
+            # that already had a pipeline was never used
+            if ownsEngine and pipeline.engine is not engine:
+                engine.stop()
+            ownsEngine = False
+        
+        resumed = None
+        if checkpoints is not None and countingConfig is not None:
+            resumed = checkpoints.load(bayNo, countingConfig.getint("resume_grace_seconds", 900))
+        if resumed:
+            startTime = resumed["startTime"]
+            logger.info(f"Bay {bayNo} resuming session started at {startTime} from checkpoint")
+        
+        # a camera that never delivers fails the start with an ack instead of retrying forever
+        firstFrameTimeout = countingConfig.getfloat("first_frame_timeout_seconds", 30) if countingConfig is not None else 30
+        firstFrameDeadline = time.monotonic() + firstFrameTimeout
+        packet = None
+        while packet is None:
+            if stopEvent.is_set():
+                return None
+            if time.monotonic() > firstFrameDeadline:
+                logger.error(f"Bay {bayNo} got no frame within {firstFrameTimeout}s, camera {pipeline.capture.state}")
+                client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "Error camera not reachable", "statusCode": 504, "cameraState": pipeline.capture.state}))
+                main.close(bayNo)
+                return None
+            packet = pipeline.readNext(0, timeout = 1)
+        # the ring slot is reused once newer frames arrive, the last frame upload may still need this one
+        frame = packet.frame.copy()
+        lastSeq = packet.seq
+        if not resumed:
+            try:
+                imageName = f"first_frame_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+                # the start record goes at count priority so it is always sent before this session's alert and close
+                # records; only the image waits behind the counts
+                submitUpload(utilities.PRIORITY_COUNT, (None, ftpFolder, imageName, None, imageFolderName,
+                    bayDetails), {"table": table, "url" : sackAnalyticsUrl, "startTime" : startTime})
+                submitUpload(utilities.PRIORITY_IMAGE, (ftpInfo, ftpFolder, imageName, frame, imageFolderName, 
+                    bayDetails), {"table": table, "url" : sackAnalyticsUrl,
+                    "startTime" : startTime, "profile": "first_frame", "region": evidenceRegion,
+                    "regionSize": (frameWidth, frameHeight), "snapshot": pipeline.capture.snapshot, "sendData": False})
+                
+                # uploadDataOnCloud(
+                #     ftpInfo, ftpFolder, imageName, frame, imageFolderName, 
+                #     bayDetails, table = table, url = sackAnalyticsUrl,
+                #     startTime= startTime
+                # )
+            except Exception as e:
+                logger.error(f"Error setting up FTP: {e}")
+                return None
             
         fileName = f"sack_data/sack_bag_count_{companyCode}_{storeCode}_{bayNo}.json"
             
-        uncrossedLineSacks = {"loading": [], "unLoading": []}
-        crossedLineSacks = {"loading": [], "unLoading": []}
+        trackTtl, hysteresis, crossingMode = 250, 0, "side"
+        if countingConfig is not None:
+            trackTtl = countingConfig.getint("track_ttl_frames", 250)
+            hysteresis = countingConfig.getfloat("hysteresis_px", 0)
+            crossingMode = countingConfig.get("crossing_mode", "side")
+        registry = TrackRegistry(loi[0], loi[1], direction, ttl = trackTtl, hysteresis = hysteresis, mode = crossingMode)
+        checkpointInterval = countingConfig.getint("checkpoint_interval_frames", 25) if countingConfig is not None else 25
+        gateReportInterval = inferenceConfig.getint("motion_report_interval", 60) if inferenceConfig is not None else 60
+        gateReportTime = time.time()
+        publishMetric = publisher.publish if publisher is not None else client.publish
         alertTriggered = 0
+        if resumed:
+            registry.restore(resumed["state"])
+            alertTriggered = resumed["alertTriggered"]
+            if registry.tracks:
+                engine.reserveTrackIds(max(registry.tracks))
         
         # fourcc = cv2.VideoWriter_fourcc(*'mp4v')
         # out = cv2.VideoWriter('sack_bag_detection_count.mp4', fourcc, 25.0, (frameWidth, frameHeight))
-        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "started", "statusCode" : 200}))
+        client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "started", "statusCode" : 200, "resumed": bool(resumed)}))
         
         while not stopEvent.is_set():
             
@@ -229,81 +254,91 @@ def sackBagCount(bayDetails, rtsp, direction, frameWidth, frameHeight,modelName,
                 logger.info("Stopping sackBagCount thread")
                 break
             
-            ret, frame = cap.read()
-            if not ret:
-                cap.release()
-                print("Reconnecting to RTSP stream...")
-                cap = cv2.VideoCapture(rtsp)
-                time.sleep(1)
+            # every analysed frame is counted in order, only the drawing below skips to the newest packet
+            tracked = pipeline.readTracks(bayNo, timeout = 1)
+            if tracked is None:
+                continue
+            _, detections, objects, crosses = tracked
+            gatedFraction = pipeline.gatedFraction()
+            if gatedFraction is not None and time.time() - gateReportTime >= gateReportInterval:
+                publishMetric("sack/bag/metrics", json.dumps({"bayNo": bayNo, "gatedFraction": round(gatedFraction, 3)}))
+                gateReportTime = time.time()
+            if commandTime is not None:
+                timeToFirstInference = int((time.monotonic() - commandTime) * 1000)
+                logger.info(f"Bay {bayNo} time to first inference: {timeToFirstInference} ms")
+                publishMetric("sack/bag/metrics", json.dumps({"bayNo": bayNo, "timeToFirstInferenceMs": timeToFirstInference}))
+                commandTime = None
+            countSacks(objects, registry, crosses)
+            if checkpoints is not None and registry.frame % checkpointInterval == 0:
+                checkpoints.save(bayNo, startTime, registry, alertTriggered)
+            if detections:
+                # publish data to MQTT broker
+                if not alertTriggered and countLimit != "":
+                    countLimit = int(countLimit)
+                    if registry.unLoadingCount > countLimit or registry.loadingCount > countLimit:
+                        submitUpload(utilities.PRIORITY_COUNT, (None, None, None, None, None, 
+                            bayDetails), {"table": table, "url" : sackAnalyticsUrl,
+                            "startTime" : startTime, "triggerAlert" : 1})
+                        logger.info("alert Triggered")
+                        # uploadDataOnCloud(
+                        #     None, None, None, None, None, 
+                        #     bayDetails, table = table, url = sackAnalyticsUrl,
+                        #     triggerAlert = 1,
+                        #     startTime= startTime
+                        # )
+                        alertTriggered = 1
+                    
+            data  = {
+                "unloadingSacks": registry.unLoadingCount,
+                "loadingSacks": registry.loadingCount,
+            }
+            if publisher is not None:
+                publisher.update(bayNo, data)
+            elif client and detections:
+                client.publish("sack/bag/counter",json.dumps({"bayNo":bayNo, "data": data}))
+            
+            # the display skips to the newest packet, and only once the bay has caught up with its queue
+            if pipeline.pending(bayNo):
+                continue
+            packet = pipeline.readNext(lastSeq, timeout = 0)
+            if packet is None:
                 continue
-            frame = cv2.resize(frame, (frameWidth, frameHeight))
-            results =  model.track(frame,imgsz = 640, conf=0.2,persist=True, iou = 0.4, tracker = "bytetrack.yaml", verbose =False)
-            frame = cv2.line(frame, (int(loi[0][0]),int(loi[0][1]) ), (int(loi[1][0]), int(loi[1][1])), color=(0, 255, 0), thickness=2)
-            objectCoordinates = utilities.fetchObject(results, objects=[1], roi = roi)
-            if objectCoordinates.get(1) is not None:
-                if loi is not None:
-                    countSacks(objectCoordinates.get(1),uncrossedLineSacks, crossedLineSacks, direction, loi[0], loi[1])
-                    for id in objectCoordinates.get(1).keys():
-                        x, y = objectCoordinates.get(1).get(id)
-                    # publish data to MQTT broker
-                    if not alertTriggered and countLimit != "":
-                        countLimit = int(countLimit)
-                        if len(crossedLineSacks["unLoading"]) > countLimit or len(crossedLineSacks["loading"]) > countLimit:
-                            threading.Thread(target = uploadDataOnCloud, args = (None, None, None, None, None, 
-                                bayDetails), kwargs = {"table": table, "url" : sackAnalyticsUrl,
-                                "startTime" : startTime, "triggerAlert" : 1} ).start()
-                            logger.info("alert Triggered")
-                            # uploadDataOnCloud(
-                            #     None, None, None, None, None, 
-                            #     bayDetails, table = table, url = sackAnalyticsUrl,
-                            #     triggerAlert = 1,
-                            #     startTime= startTime
-                            # )
-                            alertTriggered = 1
-                        
-                    publish = {}
-                    data  = {
-                        "unloadingSacks": len(crossedLineSacks["unLoading"]),
-                        "loadingSacks": len(crossedLineSacks["loading"]),
-                    }
-                    publish = {
-                        "bayNo":bayNo, 
-                        "data": data,
-                    }
-                    if client:
-                        # print("publish")
-                        client.publish("sack/bag/counter",json.dumps(publish))
-                        
-                    # utilities.saveDataInJson(fileName, data)
-                else:
-                    raise sackExceptions(code = "SC-003", message = "Line of Interest (loi) not provided")
-                # post alert if countLimit is reached in api
-            cv2.imshow(f"frame{bayNo}", results[0].plot())
+            lastSeq = packet.seq
+            # the packet frame is shared with the other bays on this camera
+            frame = cv2.line(packet.frame.copy(), (int(loi[0][0]),int(loi[0][1]) ), (int(loi[1][0]), int(loi[1][1])), color=(0, 255, 0), thickness=2)
+                    
+            # utilities.saveDataInJson(fileName, data)
+            cv2.imshow(f"frame{bayNo}", packet.results[0].plot())
             # out.write(results[0].plot())
             if cv2.waitKey(1) & 0xFF == ord('q'):  # Press 'q' to exit
                 break
             
         lastImageName = f"last_frame_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
         isCountIncorrect =  True
-        if countLimit == len(crossedLineSacks["unLoading"]) or countLimit == len(crossedLineSacks["loading"]):
+        if countLimit == registry.unLoadingCount or countLimit == registry.loadingCount:
             isCountIncorrect = False
             
         if not alertTriggered  and countLimit != "":
-            if countLimit > len(crossedLineSacks["unLoading"]) or countLimit > len(crossedLineSacks["loading"]):
-                threading.Thread(target = uploadDataOnCloud, args = (None, None, None, None, None, 
-                                bayDetails), kwargs = {"table": table, "url" : sackAnalyticsUrl,
-                                "startTime" : startTime, "triggerAlert" : 1, "alertReason" : "count less than Count Limit"} ).start()
+            if countLimit > registry.unLoadingCount or countLimit > registry.loadingCount:
+                submitUpload(utilities.PRIORITY_COUNT, (None, None, None, None, None, 
+                                bayDetails), {"table": table, "url" : sackAnalyticsUrl,
+                                "startTime" : startTime, "triggerAlert" : 1, "alertReason" : "count less than Count Limit"})
             
-        threading.Thread(target = uploadDataOnCloud, args = (ftpInfo, ftpFolder, lastImageName, frame, imageFolderName,
-                            bayDetails), kwargs = {"table": table, "isClosed": True, "url" : sackAnalyticsUrl,
-                                                   "loadingCount" : len(crossedLineSacks["loading"]), "unLoadingCount" :len(crossedLineSacks["unLoading"]),
-                            "startTime" : startTime, "isCountIncorrect" :isCountIncorrect} ).start()
+        submitUpload(utilities.PRIORITY_COUNT, (ftpInfo, ftpFolder, lastImageName, frame, imageFolderName,
+                            bayDetails), {"table": table, "isClosed": True, "url" : sackAnalyticsUrl,
+                                                   "loadingCount" : registry.loadingCount, "unLoadingCount" :registry.unLoadingCount,
+                            "startTime" : startTime, "isCountIncorrect" :isCountIncorrect,
+                            "profile": "last_frame", "region": evidenceRegion, "regionSize": (frameWidth, frameHeight)})
         # uploadDataOnCloud(
         #     ftpInfo, ftpFolder, lastImageName, 
         #     frame, imageFolderName, bayDetails, isClosed=True, table=table,
-        #     loadingCount=len(crossedLineSacks["loading"]), unLoadingCount=len(crossedLineSacks["unLoading"]),
+        #     loadingCount=registry.loadingCount, unLoadingCount=registry.unLoadingCount,
         #     isCountIncorrect=False, url=sackAnalyticsUrl, startTime= startTime
         # )
+        if checkpoints is not None:
+            checkpoints.clear(bayNo)
+        if publisher is not None:
+            publisher.remove(bayNo)
         cv2.destroyWindow(f"frame{bayNo}")      
     except sackExceptions as e:
         logger.error(e)
@@ -314,4 +349,9 @@ def sackBagCount(bayDetails, rtsp, direction, frameWidth, frameHeight,modelName,
         logger.error("Error in sackBagCount" + traceback.format_exc())
         main.close(bayNo)
         client.publish("sack/bag/ack", json.dumps({"bayNo": bayNo, "status": "stop due to some error", "statusCode": 400}))
-        return None
\ No newline at end of file
+        return None
+    finally:
+        cameraPipeline.detachBay(rtsp, bayNo)
+        # still set only when the engine never reached a pipeline
+        if ownsEngine:
+            engine.stop()
@@ -0,0 +1,75 @@
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+from commandQueue import CommandQueue
+
+# run from Sack-Bag-Count: python -m unittest test_commandQueue
+
+
+class CommandQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.journalPath = os.path.join(self.folder, "commands.db")
+        self.commands = CommandQueue(self.journalPath)
+
+    def tearDown(self):
+        self.commands.close()
+        shutil.rmtree(self.folder)
+
+    def reopen(self):
+        # a restart after a crash, the journal is all that is left
+        self.commands.close()
+        self.commands = CommandQueue(self.journalPath)
+
+    def age(self, commandId, seconds):
+        self.commands.conn.execute("update commands set receivedAt = datetime('now', ?) where id = ?", (f"-{seconds} seconds", commandId))
+        self.commands.conn.commit()
+
+    def test_put_delivers_in_order(self):
+        first = self.commands.put({"bayNo": 1, "status": "start"})
+        second = self.commands.put({"bayNo": 1, "status": "stop"})
+        self.assertEqual(self.commands.get(timeout = 1), (first, {"bayNo": 1, "status": "start"}))
+        self.assertEqual(self.commands.get(timeout = 1), (second, {"bayNo": 1, "status": "stop"}))
+
+    def test_recover_replays_only_unacked_commands(self):
+        first = self.commands.put({"bayNo": 1})
+        second = self.commands.put({"bayNo": 2})
+        self.commands.ack(first)
+        self.reopen()
+        self.assertEqual(self.commands.recover(maxAge = 300), 1)
+        self.assertEqual(self.commands.get(timeout = 1), (second, {"bayNo": 2}))
+        self.assertRaises(queue.Empty, self.commands.get, timeout = 0)
+
+    def test_recover_expires_old_commands(self):
+        old = self.commands.put({"bayNo": 1})
+        fresh = self.commands.put({"bayNo": 2})
+        self.age(old, 3600)
+        self.reopen()
+        expired = []
+        with self.assertLogs("sackBag_logger.commands", level = "WARNING"):
+            self.assertEqual(self.commands.recover(maxAge = 300, onExpired = expired.append), 1)
+        self.assertEqual(expired, [{"bayNo": 1}])
+        self.assertEqual(self.commands.get(timeout = 1), (fresh, {"bayNo": 2}))
+        # the expired command is acked, a second restart does not see it again
+        remaining = self.commands.conn.execute("select id from commands").fetchall()
+        self.assertEqual(remaining, [(fresh,)])
+
+    def test_recover_without_max_age_replays_everything(self):
+        old = self.commands.put({"bayNo": 1})
+        self.age(old, 3600)
+        self.reopen()
+        self.assertEqual(self.commands.recover(), 1)
+        self.assertEqual(self.commands.get(timeout = 1), (old, {"bayNo": 1}))
+
+    def test_sink_replaces_the_queue(self):
+        delivered = []
+        self.commands.setSink(delivered.append)
+        commandId = self.commands.put({"bayNo": 3})
+        self.assertEqual(delivered, [(commandId, {"bayNo": 3})])
+
+
+if __name__ == "__main__":
+    unittest.main()
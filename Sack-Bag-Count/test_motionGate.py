@@ -0,0 +1,40 @@
+import unittest
+
+from motionGate import MotionGate
+
+# run from Sack-Bag-Count: python -m unittest test_motionGate
+
+
+def gateWithMotion(levels, **kwargs):
+    # replays the given motion levels instead of measuring frames
+    gate = MotionGate(**kwargs)
+    levels = iter(levels)
+    gate.motion = lambda frame: next(levels)
+    return gate
+
+
+class MotionGateTest(unittest.TestCase):
+    def test_still_scene_keeps_the_min_duty_cycle(self):
+        gate = gateWithMotion([0.0] * 12, minDutyCycle = 0.25)
+        decisions = [gate.check(None) for _ in range(12)]
+        self.assertEqual(decisions, [False, False, False, True] * 3)
+        self.assertAlmostEqual(gate.gatedFraction(), 0.75)
+
+    def test_motion_wakes_for_wake_frames(self):
+        gate = gateWithMotion([0.5, 0.0, 0.0, 0.0], wakeFrames = 3, minDutyCycle = 0)
+        decisions = [gate.check(None) for _ in range(4)]
+        self.assertEqual(decisions, [True, True, True, False])
+
+    def test_zero_duty_cycle_gates_every_still_frame(self):
+        gate = gateWithMotion([0.0] * 50, minDutyCycle = 0)
+        self.assertFalse(any(gate.check(None) for _ in range(50)))
+        self.assertEqual(gate.gatedFraction(), 1.0)
+
+    def test_motion_resets_the_gated_run(self):
+        gate = gateWithMotion([0.0, 0.0, 0.5, 0.0, 0.0, 0.0], wakeFrames = 1, minDutyCycle = 0.25)
+        decisions = [gate.check(None) for _ in range(6)]
+        self.assertEqual(decisions, [False, False, True, False, False, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
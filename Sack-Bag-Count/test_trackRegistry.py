@@ -0,0 +1,96 @@
+import unittest
+
+from trackRegistry import TrackRegistry, segmentsIntersect
+
+# run from Sack-Bag-Count: python -m unittest test_trackRegistry
+
+# a vertical loi at x = 0, "left" is x < 0 and "right" is x > 0
+POINT1, POINT2 = (0, 0), (0, 10)
+
+
+class SegmentsIntersectTest(unittest.TestCase):
+    def test_crossing(self):
+        self.assertTrue(segmentsIntersect((-5, 5), (5, 5), POINT1, POINT2))
+
+    def test_passing_beyond_the_end(self):
+        self.assertFalse(segmentsIntersect((-5, 20), (5, 20), POINT1, POINT2))
+
+    def test_same_side(self):
+        self.assertFalse(segmentsIntersect((-5, 2), (-1, 8), POINT1, POINT2))
+
+    def test_touching_counts(self):
+        self.assertTrue(segmentsIntersect((-5, 5), (0, 5), POINT1, POINT2))
+
+
+class SideCrossingTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = TrackRegistry(POINT1, POINT2, "left")
+
+    def test_leaving_the_direction_side_loads(self):
+        self.registry.update({1: (-5, 5)})
+        self.registry.update({1: (5, 5)})
+        self.assertEqual((self.registry.loadingCount, self.registry.unLoadingCount), (1, 0))
+
+    def test_entering_the_direction_side_unloads(self):
+        self.registry.update({1: (5, 5)})
+        self.registry.update({1: (-5, 5)})
+        self.assertEqual((self.registry.loadingCount, self.registry.unLoadingCount), (0, 1))
+
+    def test_crossing_back_undoes_the_count(self):
+        for point in ((-5, 5), (5, 5), (-5, 5)):
+            self.registry.update({1: point})
+        self.assertEqual(self.registry.loadingCount, 0)
+
+    def test_staying_on_one_side_counts_nothing(self):
+        for point in ((-5, 5), (-3, 6), (-1, 7)):
+            self.registry.update({1: point})
+        self.assertEqual((self.registry.loadingCount, self.registry.unLoadingCount), (0, 0))
+
+    def test_hysteresis_band_is_ignored(self):
+        registry = TrackRegistry(POINT1, POINT2, "left", hysteresis = 2)
+        for point in ((-5, 5), (1, 5)):
+            registry.update({1: point})
+        self.assertEqual(registry.loadingCount, 0)
+        registry.update({1: (5, 5)})
+        self.assertEqual(registry.loadingCount, 1)
+
+    def test_stale_tracks_are_evicted(self):
+        registry = TrackRegistry(POINT1, POINT2, "left", ttl = 2)
+        registry.update({1: (-5, 5)})
+        registry.update({2: (-5, 5)})
+        self.assertIn(1, registry.tracks)
+        registry.update({2: (-5, 5)})
+        self.assertNotIn(1, registry.tracks)
+        self.assertIn(2, registry.tracks)
+
+    def test_snapshot_restores_counts_and_state(self):
+        self.registry.update({1: (-5, 5), 2: (5, 5)})
+        self.registry.update({1: (5, 5)})
+        restored = TrackRegistry(POINT1, POINT2, "left")
+        restored.restore(self.registry.snapshot())
+        restored.update({2: (-5, 5)})
+        self.assertEqual((restored.loadingCount, restored.unLoadingCount), (1, 1))
+
+
+class SegmentCrossingTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = TrackRegistry(POINT1, POINT2, "left", mode = "segment")
+
+    def test_jump_across_the_line_counts(self):
+        self.registry.update({1: (-50, 5)})
+        self.registry.update({1: (50, 5)})
+        self.assertEqual(self.registry.loadingCount, 1)
+
+    def test_passing_beside_the_line_does_not_count(self):
+        self.registry.update({1: (-5, 20)})
+        self.registry.update({1: (5, 20)})
+        self.assertEqual((self.registry.loadingCount, self.registry.unLoadingCount), (0, 0))
+
+    def test_each_direction_counts_once(self):
+        for point in ((-5, 5), (5, 5), (-5, 5)):
+            self.registry.update({1: point})
+        self.assertEqual((self.registry.loadingCount, self.registry.unLoadingCount), (0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import math
+from collections import OrderedDict
+
+
+def orientation(a, b, p):
+    return (b[0] - a[0]) * (p[1] - a[1]) - (b[1] - a[1]) * (p[0] - a[0])
+
+def segmentsIntersect(p1, p2, q1, q2):
+    d1, d2 = orientation(q1, q2, p1), orientation(q1, q2, p2)
+    d3, d4 = orientation(p1, p2, q1), orientation(p1, p2, q2)
+    return ((d1 > 0) != (d2 > 0) or d1 == 0 or d2 == 0) and ((d3 > 0) != (d4 > 0) or d3 == 0 or d4 == 0)
+
+
+class TrackState:
+    __slots__ = ("uncrossedLoading", "uncrossedUnLoading", "crossedLoading", "crossedUnLoading", "lastSeen", "lastPoint")
+
+    def __init__(self):
+        self.uncrossedLoading = False
+        self.uncrossedUnLoading = False
+        self.crossedLoading = False
+        self.crossedUnLoading = False
+        self.lastSeen = 0
+        self.lastPoint = None
+
+
+class TrackRegistry:
+    """Per-track line-crossing state keyed by track id, with O(1) updates and TTL eviction of dropped tracks."""
+    def __init__(self, point1, point2, direction, ttl = 250, hysteresis = 0, mode = "side"):
+        self.point1 = point1
+        self.point2 = point2
+        self.direction = direction
+        self.ttl = ttl
+        self.hysteresis = hysteresis
+        self.mode = mode
+        self.length = math.hypot(point2[0] - point1[0], point2[1] - point1[1]) or 1
+        self.tracks = OrderedDict()
+        self.frame = 0
+        self.loadingCount = 0
+        self.unLoadingCount = 0
+
+    def side(self, point, cross = None):
+        # same convention as utilities.point_position
+        if cross is None:
+            cross = orientation(self.point1, self.point2, point)
+        if self.hysteresis and abs(cross) / self.length < self.hysteresis:
+            return None
+        if cross > 0:
+            return "left"
+        elif cross < 0:
+            return "right"
+        return "On the Line"
+
+    def update(self, objectsCoordinates, crosses = None):
+        self.frame += 1
+        for id, point in objectsCoordinates.items():
+            state = self.tracks.get(id)
+            if state is None:
+                state = TrackState()
+                self.tracks[id] = state
+            else:
+                self.tracks.move_to_end(id)
+            state.lastSeen = self.frame
+
+            side = self.side(point, crosses.get(id) if crosses else None)
+            if side is None:
+                continue
+            if self.mode == "segment":
+                self.updateSegment(state, point, side)
+            elif side != self.direction:
+                if state.uncrossedLoading:
+                    state.uncrossedLoading = False
+                    state.crossedLoading = True
+                    self.loadingCount += 1
+                else:
+                    state.uncrossedUnLoading = True
+                    if state.crossedUnLoading:
+                        state.crossedUnLoading = False
+                        self.unLoadingCount -= 1
+            else:
+                if state.uncrossedUnLoading:
+                    state.uncrossedUnLoading = False
+                    state.crossedUnLoading = True
+                    self.unLoadingCount += 1
+                else:
+                    state.uncrossedLoading = True
+                    if state.crossedLoading:
+                        state.crossedLoading = False
+                        self.loadingCount -= 1
+        self.evict()
+
+    def updateSegment(self, state, point, side):
+        # counts only when the step between two observations passes through the finite LOI,
+        # so a sack that jumps across the line between processed frames is still counted
+        previous = state.lastPoint
+        state.lastPoint = point
+        if previous is None or not segmentsIntersect(previous, point, self.point1, self.point2):
+            return
+        previousSide = self.side(previous)
+        if previousSide == self.direction and side != self.direction:
+            if not state.crossedLoading:
+                state.crossedLoading = True
+                self.loadingCount += 1
+            if state.crossedUnLoading:
+                state.crossedUnLoading = False
+                self.unLoadingCount -= 1
+        elif previousSide != self.direction and side == self.direction:
+            if not state.crossedUnLoading:
+                state.crossedUnLoading = True
+                self.unLoadingCount += 1
+            if state.crossedLoading:
+                state.crossedLoading = False
+                self.loadingCount -= 1
+
+    def snapshot(self):
+        tracks = []
+        for id, state in self.tracks.items():
+            flags = state.uncrossedLoading | state.uncrossedUnLoading << 1 | state.crossedLoading << 2 | state.crossedUnLoading << 3
+            tracks.append([id, flags, state.lastSeen, state.lastPoint])
+        return {"frame": self.frame, "loading": self.loadingCount, "unLoading": self.unLoadingCount, "tracks": tracks}
+
+    def restore(self, snapshot):
+        self.frame = snapshot["frame"]
+        self.loadingCount = snapshot["loading"]
+        self.unLoadingCount = snapshot["unLoading"]
+        self.tracks = OrderedDict()
+        for id, flags, lastSeen, lastPoint in snapshot["tracks"]:
+            state = TrackState()
+            state.uncrossedLoading = bool(flags & 1)
+            state.uncrossedUnLoading = bool(flags & 2)
+            state.crossedLoading = bool(flags & 4)
+            state.crossedUnLoading = bool(flags & 8)
+            state.lastSeen = lastSeen
+            state.lastPoint = tuple(lastPoint) if lastPoint is not None else None
+            self.tracks[id] = state
+
+    def evict(self):
+        # tracks are ordered by last update, so stale ones are always at the front
+        while self.tracks:
+            id, state = next(iter(self.tracks.items()))
+            if self.frame - state.lastSeen < self.ttl:
+                break
+            self.tracks.popitem(last=False)
@@ -12,135 +12,24 @@ import paho.mqtt.client as mqtt
 from paho.mqtt.client import CallbackAPIVersion
 import sqlite3
 import requests
-
+import sys
+
+# logSetup and the capture, evidence, upload and api modules are shared with the root level scripts one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from logSetup import setupLogging
+from captureBuffer import VideoCaptureBuffer
+from evidence import encodeJpeg, configureEvidenceProfiles, getEvidenceProfile, evidenceStats
+import uploadQueue
+from uploadQueue import (PRIORITY_COUNT, PRIORITY_IMAGE, getBandwidthGovernor, getFtpPool, getUploadExecutor,
+                         getImageSpool, getDrainLimiter)
+from apiClient import getHttpClient, sendRecords, drainOutbox
 
 logger = logging.getLogger("sackBag_logger")
 
-class VideoCaptureBuffer:
-    """Efficiently captures frames in a separate thread to reduce lag and distortion."""
-    def __init__(self, video_source):
-        self.video_source = video_source
-        self.cap = cv2.VideoCapture(video_source)
-        self.buffer_frame = None
-        self.stopped = False
-        self.lock = threading.Lock()
-        self.is_rtsp = isinstance(video_source, str) and video_source.startswith("rtsp")
-
-        # Start the frame updating thread
-        self.thread = threading.Thread(target=self.update_frames, daemon=True)
-        self.thread.start()
+def getOutbox(schema, dbPath = None):
+    # the outbox db stays next to this app's own code
+    return uploadQueue.getOutbox(schema, dbPath or os.path.join(os.path.dirname(__file__), 'sackBag.db'))
 
-    def update_frames(self):
-        while not self.stopped:
-            ret, frame = self.cap.read()
-            if ret:
-                with self.lock:
-                    self.buffer_frame = frame
-                time.sleep(0.01)  # Small delay to prevent CPU overuse
-            else:
-                if self.is_rtsp:
-                    print("Failed to capture frame from RTSP, retrying...")
-                    time.sleep(1)
-                else:
-                    print("Failed to capture frame, reinitializing...")
-                    self.cap.release()
-                    self.cap = cv2.VideoCapture(self.video_source)
-                    time.sleep(1)
-
-    def read(self):
-        with self.lock:
-            frame = self.buffer_frame
-        return frame is not None, frame
-
-    def release(self):
-        self.stopped = True
-        self.thread.join()
-        self.cap.release()
-        
-class setupDB:
-    def __init__(self, table):
-        db_path = os.path.join(os.path.dirname(__file__), 'sackBag.db')
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute(table)
-        self.commit
-    def commit(self):
-        self.conn.commit()
-    def close(self):
-        self.conn.close()
-
-class setupFtp:
-    def __init__(self, userName, password, host, port, timeout = 10):
-        self.userName = userName
-        self.password = password
-        self.host = host
-        self.port = port
-        self.timeout = timeout
-        self.ftp = None
-        self.connect()
-        # self.ftp = FTP(host = self.host, user = self.userName, passwd = self.password, port = self.port)
-
-            
-    def connect(self):
-        try:
-            self.ftp = FTP()
-            self.ftp.connect(self.host, self.port, timeout=self.timeout)
-            self.ftp.login(self.userName, self.password)
-            logger.info(f"Connected to FTP server {self.host}:{self.port}")
-        except all_errors as e:
-            logger.error(f"FTP connection failed: {e}")
-            self.ftp = None
-            
-    def sendFile(self,fileName, stream):
-        if not self.ftp:
-            logger.error("FTP connection is not established.")
-            return False
-        try:
-            res = self.ftp.storbinary(f'STOR {fileName}', stream)
-            msg = 'Upload %s to FTP Server %s.'
-            if res.startswith('226 Transfer complete'):
-                logger.error(msg % ('success', self.host))
-                return True
-            else:
-                logger.error(msg % ('falied', self.host)) 
-                return False  
-        except all_errors as e:
-            logger.error(f"Error in sendFile: {e}")
-            return False
-        
-    def ftp_mkdir_recursive(self, path):
-        try:
-            if path == '' or path == '.':
-                return
-            parent = os.path.dirname(path)
-            if parent and parent != path:
-                self.ftp_mkdir_recursive(parent)
-            
-            try:
-                self.ftp.mkd(path)
-            except Exception as e:
-                if "file already exists" in str(e):
-                    return
-                if "closed by the remote host" in str (e):
-                    return
-                self.ftp_mkdir_recursive(os.path.dirname(path))
-                self.ftp.mkd(path)
-        except Exception as e:
-            logger.error(f"file already exits, {e}")
-
-        
-    def close(self):
-        if self.ftp:
-            try:
-                self.ftp.quit() 
-                logger.info("FTP connection closed.")
-            except all_errors as e:
-                logger.error(f"Error closing FTP connection: {e}")
-            finally:
-                self.ftp = None
-        else:
-            logger.error("FTP connection is not established.")
-            return 
 
 class MQTTClient:
     def __init__(self, client_id, broker='localhost', port=1883, keepalive=60, topic = None, on_message=None, transport = "tcp"):
@@ -182,8 +71,8 @@ class MQTTClient:
     # Publish a message
     def publish(self, topic, payload, qos=0, retain=False):
         with self.lock:
-            print(f"Publishing to {topic}: {payload}")
             self.client.publish(topic, payload, qos, retain, properties=None)
+        logger.debug("Publishing to %s: %s", topic, payload)
 
     # Default callback for successful connection
     def on_connect(self,client, userdata, flags, reason_code, properties =None):
@@ -204,7 +93,7 @@ class MQTTClient:
         print(f"Subscribed with QoS: {granted_qos}")
 
     def on_publish(self, client, userdata, mid, reason_code, properties =None):
-        print(f"Message published (mid: {mid})")
+        logger.debug("Message published (mid: %s)", mid)
 
     def set_on_message(self, callback):
         self.client.on_message = callback
@@ -238,33 +127,20 @@ def saveDataInJson(fileName,data):
         logger.error(f"Error in saveDataInJson: {e}")
         return
 
-def uploadFileOnFtp(ftp,frame, ftpPath):
-    try:
-        if ftp is None or not isinstance(ftp, setupFtp):
-            logger.error("Invalid FTP connection")
-            return False
-        success, encoded_image = cv2.imencode('.jpg', frame)
-        if success:
-            image_bytes = encoded_image.tobytes()
-            stream = BytesIO(image_bytes)
-            res = ftp.sendFile(ftpPath,stream)
-            return res
-    except Exception as e:
-        logger.error(f"Error in uploadFileOnFtp: {e}")
-        return False
 
-def sendRequest(url, data = None, method = "POST"):
+def sendRequest(url, data = None, method = "POST", trafficClass = "count"):
     try:
-        logger.info(f"data {data}")
-        headers = {
-            'content-type': 'application/json',
-        }
+        logger.debug("data %s", data)
         if method == "POST":
-            response = requests.post(url, json=data, headers=headers)
+            response = getHttpClient().post(url, data, trafficClass)
         else:
-            response = requests.get(url)
+            response = getHttpClient().get(url)
+        if response is None:
+            return {
+                "status": 500
+            }
         if response.status_code == 200:
-            logger.error(f"Data sent successfully to {url}")
+            logger.debug("Data sent successfully to %s", url)
             return {
                 "data": response.json(),
                 "status": 200
@@ -280,7 +156,8 @@ def sendRequest(url, data = None, method = "POST"):
         return {
             "status": 500
         }
-    
+
+
 def point_position(a, b, p):
     try:
     # a, b, p = (x, y)
@@ -294,6 +171,22 @@ def point_position(a, b, p):
     except Exception as e:
         logger.error(f"Error in point_position: {e}")
 
+def inferenceWindow(roi, loi, margin, frameWidth, frameHeight):
+    try:
+        points = [[int(p["x"]), int(p["y"])] for p in roi or []]
+        points += [[int(p[0]), int(p[1])] for p in loi or []]
+        if not points:
+            return None
+        x, y, w, h = cv2.boundingRect(np.array(points, dtype=np.int32))
+        x1, y1 = max(0, x - margin), max(0, y - margin)
+        x2, y2 = min(frameWidth, x + w + margin), min(frameHeight, y + h + margin)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2, y2
+    except Exception as e:
+        logger.error(f"Error in inferenceWindow: {e}")
+        return None
+
 def objectInsidePolygon(points, person):
     try:
         pts = np.array([[int(p["x"]), int(p["y"])] for p in points], dtype=np.int32)
@@ -325,7 +218,6 @@ def fetchObject(results, objects = [], roi = None):
     except Exception as e:
         logger.error(f"error in fetch Object {e}")
         return {}
-    
 
 
             
\ No newline at end of file
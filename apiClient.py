@@ -0,0 +1,139 @@
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from uploadQueue import getBandwidthGovernor
+
+# api session and outbox drain shared by the root level scripts and the Sack-Bag-Count and Dwell_Time apps
+
+logger = logging.getLogger("shared.http")
+
+RETRY_STATUS = (429, 502, 503, 504)
+
+class HttpClient:
+    """Keep-alive session shared by every api call, with connect/read timeouts and jittered retry."""
+    def __init__(self, poolSize = 8, connectTimeout = 3.05, readTimeout = 10, retries = 3, backoff = 0.5, maxBackoff = 10, batchSize = 0, batchUrl = None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = poolSize, pool_maxsize = poolSize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({'content-type': 'application/json'})
+        self.timeout = (connectTimeout, readTimeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.batchSize = batchSize
+        self.batchUrl = batchUrl
+
+    def request(self, method, url, trafficClass = "count", **kwargs):
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                getBandwidthGovernor().acquire(len(kwargs.get("data") or b""), trafficClass)
+                response = self.session.request(method, url, timeout = self.timeout, **kwargs)
+                if response.status_code not in RETRY_STATUS:
+                    return response
+                error = f"{response.status_code} - {response.text}"
+            except requests.ConnectionError as e:
+                # only failures where the request never reached the api are retried, a read timeout may already be saved
+                response = None
+                error = e
+            except requests.RequestException as e:
+                logger.error(f"Request to {url} failed: {e}")
+                return None
+            if attempt < self.retries:
+                time.sleep(random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** attempt)))
+        logger.error(f"Request to {url} failed after {self.retries + 1} attempts: {error}")
+        return response
+
+    def post(self, url, data, trafficClass = "count"):
+        return self.request("POST", url, trafficClass = trafficClass, data = json.dumps(data).encode())
+
+    def get(self, url):
+        return self.request("GET", url)
+
+httpClient = None
+httpClientLock = threading.Lock()
+
+def getHttpClient(httpInfo = None):
+    # the first caller configures the shared client, later callers just get it
+    global httpClient
+    with httpClientLock:
+        if httpClient is None:
+            if httpInfo is None:
+                httpClient = HttpClient()
+            else:
+                httpClient = HttpClient(
+                    poolSize = httpInfo.getint("pool_size", 8),
+                    connectTimeout = httpInfo.getfloat("connect_timeout", 3.05),
+                    readTimeout = httpInfo.getfloat("read_timeout", 10),
+                    retries = httpInfo.getint("retries", 3),
+                    backoff = httpInfo.getfloat("backoff_seconds", 0.5),
+                    batchSize = httpInfo.getint("batch_size", 0),
+                    batchUrl = httpInfo.get("batch_url") or None
+                )
+                if httpClient.batchSize > 1 and httpClient.batchUrl is None:
+                    logger.warning("[HTTP] batch_size is set without a batch_url, records are sent one per request")
+    return httpClient
+
+def sendRecords(url, records, trafficClass = "backlog"):
+    # one request per record unless [HTTP] batch_size packs them into json list requests for batch_url;
+    # url itself is a single record endpoint and never gets a list
+    client = getHttpClient()
+    acked = []
+    if client.batchSize > 1 and client.batchUrl is not None:
+        for start in range(0, len(records), client.batchSize):
+            chunk = records[start:start + client.batchSize]
+            response = client.post(client.batchUrl, chunk, trafficClass)
+            acked.extend([response is not None and response.status_code == 200] * len(chunk))
+    else:
+        for record in records:
+            response = client.post(url, record, trafficClass)
+            acked.append(response is not None and response.status_code == 200)
+    return acked
+
+def drainOutbox(outbox, table, toRecord, url, pageSize = 200, workers = 4, limiter = None):
+    # keyset pages ordered by id; acknowledged rows are deleted and flushed page by page,
+    # so a crash re-sends at most one page and the next run starts from whatever is left
+    client = getHttpClient()
+    chunkSize = max(1, client.batchSize) if client.batchUrl is not None else 1
+    lastId = 0
+    sent = 0
+
+    def send(chunk):
+        if limiter is not None:
+            limiter.acquire()
+        return sendRecords(url, chunk)
+
+    if not outbox.drainLock.acquire(blocking=False):
+        # another thread is already draining this outbox
+        return 0
+    try:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            while True:
+                conn = outbox.reader()
+                try:
+                    rows = conn.execute(f"select * from {table} where id > ? order by id limit ?", (lastId, pageSize)).fetchall()
+                finally:
+                    conn.close()
+                if not rows:
+                    break
+                lastId = rows[-1][0]
+                records = [toRecord(row) for row in rows]
+                chunks = [records[start:start + chunkSize] for start in range(0, len(records), chunkSize)]
+                acked = [ok for result in executor.map(send, chunks) for ok in result]
+                ackedIds = [(row[0],) for row, ok in zip(rows, acked) if ok]
+                if ackedIds:
+                    outbox.executemany(f"delete from {table} where id = ?", ackedIds)
+                    outbox.flush()
+                    sent += len(ackedIds)
+                if not ackedIds:
+                    # the api is still unreachable, leave the rest for the next run
+                    break
+    finally:
+        outbox.drainLock.release()
+    return sent
@@ -0,0 +1,323 @@
+import logging
+import re
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from uploadQueue import getBandwidthGovernor
+
+# camera capture shared by the root level scripts and the Sack-Bag-Count and Dwell_Time apps
+
+logger = logging.getLogger("shared.capture")
+
+streamResolutions = {}
+streamResolutionsLock = threading.Lock()
+
+def substreamUrl(url):
+    # hikvision style channel urls: channel n main stream is n01, its first substream n02
+    match = re.search(r"(/Streaming/Channels/\d*)01(\D|$)", url or "", re.IGNORECASE)
+    if match is None:
+        return None
+    return url[:match.start()] + match.group(1) + "02" + url[match.start(2):]
+
+def openStream(url, timeoutMs = 5000):
+    if hasattr(cv2, "CAP_PROP_OPEN_TIMEOUT_MSEC"):
+        return cv2.VideoCapture(url, cv2.CAP_FFMPEG, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeoutMs, cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeoutMs])
+    return cv2.VideoCapture(url)
+
+def grabStill(url):
+    cap = openStream(url)
+    try:
+        ret, frame = cap.read()
+        return frame if ret else None
+    finally:
+        cap.release()
+
+def probeResolution(url, retryAfter = 300):
+    # a readable stream is probed once per process; a failed probe is remembered for retryAfter seconds only,
+    # so a substream that was down at startup is picked up on a later reconnect
+    with streamResolutionsLock:
+        cached = streamResolutions.get(url)
+        if cached is not None:
+            resolution, probedAt = cached
+            if resolution is not None or time.monotonic() - probedAt < retryAfter:
+                return resolution
+    frame = grabStill(url)
+    resolution = (frame.shape[1], frame.shape[0]) if frame is not None else None
+    with streamResolutionsLock:
+        streamResolutions[url] = (resolution, time.monotonic())
+    return resolution
+
+def selectStream(url, frameSize):
+    # the substream is used when it is at least the analysis size, the main stream otherwise
+    substream = substreamUrl(url)
+    if substream is None or frameSize is None:
+        return url
+    resolution = probeResolution(substream)
+    if resolution is not None and resolution[0] >= frameSize[0] and resolution[1] >= frameSize[1]:
+        logger.info(f"Using substream {resolution[0]}x{resolution[1]} for {frameSize[0]}x{frameSize[1]} analysis")
+        return substream
+    logger.info(f"Substream {resolution} is smaller than {frameSize[0]}x{frameSize[1]} or unreadable, using the main stream")
+    return url
+
+class VideoCaptureBuffer:
+    """Captures frames in a separate thread and hands each one out once, tagged with a sequence number and capture time."""
+    def __init__(self, video_source, analysis_fps = 0, on_state = None, backoff = 1, max_backoff = 30,
+                 output_size = None, ring_size = 3, hold = 1, backend = "auto", substream = "auto", read_timeout = 10):
+        # video_source may switch to the substream, main_source stays the configured url
+        self.video_source = video_source
+        self.main_source = video_source
+        self.substream = substream
+        self.substream_failed = False
+        self.analysis_fps = analysis_fps
+        self.on_state = on_state
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.read_timeout = read_timeout
+        self.last_read = time.monotonic()
+        self.output_size = tuple(output_size) if output_size else None
+        self.cap = None
+        self.proc = None
+        self.state = "connecting"
+        self.failures = 0
+        # frames are decoded into a ring of reused buffers; the newest one and the last `hold` handed out are never overwritten
+        self.ring = [None] * max(ring_size, hold + 2)
+        self.latest = None
+        self.next_slot = 0
+        self.handed = deque(maxlen = hold)
+        # full resolution decode target of the opencv backend, double buffered for snapshot()
+        self.raws = [None, None]
+        self.raw_latest = None
+        self.raw_lock = threading.Lock()
+        self.seq = 0
+        self.timestamp = None
+        self.read_seq = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.measured_fps = 0
+        self.stopped = False
+        self.wakeup = threading.Event()
+        self.condition = threading.Condition()
+        self.is_rtsp = isinstance(video_source, str) and video_source.startswith("rtsp")
+        if backend == "auto":
+            backend = "ffmpeg" if self.output_size and self.is_rtsp and shutil.which("ffmpeg") else "opencv"
+        self.backend = backend
+
+        # Start the frame updating thread, it also opens the stream so a slow camera does not block the caller
+        self.thread = threading.Thread(target=self.update_frames, daemon=True)
+        self.thread.start()
+
+    def set_state(self, state, delay = None):
+        self.state = state
+        if self.on_state is not None:
+            try:
+                self.on_state(state, self.failures, delay)
+            except Exception as e:
+                logger.error(f"Error in capture state callback: {e}")
+
+    def frame_stride(self):
+        # a file is not paced by the camera, so its frames are skipped by count instead of by time
+        if self.analysis_fps <= 0 or self.backend == "ffmpeg" or self.is_rtsp:
+            return 1
+        return max(1, round((self.cap.get(cv2.CAP_PROP_FPS) or 25) / self.analysis_fps))
+
+    def grab_due(self, stride):
+        # frames that will not be analysed are only grabbed, never retrieved into a bgr image
+        for _ in range(stride - 1):
+            if not self.cap.grab():
+                return False
+            self.skipped += 1
+        if not self.cap.grab():
+            return False
+        if self.analysis_fps > 0 and self.is_rtsp and self.timestamp is not None:
+            # a live stream is grabbed until the next analysis frame is due, within half a camera frame
+            due = self.timestamp + 1 / self.analysis_fps - 0.5 / (self.cap.get(cv2.CAP_PROP_FPS) or 25)
+            while time.time() < due:
+                self.skipped += 1
+                if not self.cap.grab():
+                    return False
+        return True
+
+    def open_source(self):
+        if self.backend == "ffmpeg":
+            # ffmpeg scales while decoding and writes raw bgr frames of exactly output_size to the pipe
+            width, height = self.output_size
+            filters = f"scale={width}:{height}"
+            if self.analysis_fps > 0:
+                filters = f"fps={self.analysis_fps}," + filters
+            command = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+            command += ["-rtsp_transport", "tcp"] if self.is_rtsp else ["-re"]
+            if self.is_rtsp and self.read_timeout > 0:
+                # microseconds; ffmpeg gives up on a socket that stops delivering instead of waiting forever
+                command += ["-rw_timeout", str(int(self.read_timeout * 1000000))]
+            command += ["-i", self.video_source, "-vf", filters, "-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+            self.proc = subprocess.Popen(command, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, bufsize = 0)
+            self.last_read = time.monotonic()
+            if self.read_timeout > 0:
+                threading.Thread(target=self.watchdog, args=(self.proc,), daemon=True).start()
+        else:
+            self.cap = cv2.VideoCapture(self.video_source)
+
+    def watchdog(self, proc):
+        # a stalled camera can leave ffmpeg alive but silent, which would block readinto forever;
+        # killing the process closes the pipe so the read fails and the reconnect path takes over
+        while proc.poll() is None and not self.stopped:
+            time.sleep(min(1, self.read_timeout / 2))
+            if time.monotonic() - self.last_read > self.read_timeout and proc.poll() is None:
+                logger.error(f"No frame from {self.video_source} in {self.read_timeout:g}s, restarting ffmpeg")
+                proc.kill()
+                return
+
+    def close_source(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+        if self.cap is not None:
+            self.cap.release()
+
+    def read_into(self, slot, stride):
+        if self.backend == "ffmpeg":
+            width, height = self.output_size
+            if self.ring[slot] is None:
+                self.ring[slot] = np.empty((height, width, 3), dtype = np.uint8)
+            view = memoryview(self.ring[slot]).cast("B")
+            filled = 0
+            while filled < len(view):
+                count = self.proc.stdout.readinto(view[filled:])
+                if not count:
+                    return False
+                filled += count
+            self.last_read = time.monotonic()
+            return True
+        if not self.grab_due(stride):
+            return False
+        if self.output_size is None:
+            ret, frame = self.cap.retrieve(self.ring[slot])
+            if ret:
+                self.ring[slot] = frame
+            return ret
+        # decode into the raw buffer snapshot() is not reading from
+        target = 0 if self.raw_latest == 1 else 1
+        ret, raw = self.cap.retrieve(self.raws[target])
+        if not ret:
+            return False
+        self.raws[target] = raw
+        with self.raw_lock:
+            self.raw_latest = target
+        width, height = self.output_size
+        if self.ring[slot] is None or self.ring[slot].dtype != raw.dtype:
+            self.ring[slot] = np.empty((height, width) + raw.shape[2:], dtype = raw.dtype)
+        cv2.resize(raw, self.output_size, dst = self.ring[slot])
+        return True
+
+    def free_slot(self):
+        busy = set(self.handed)
+        busy.add(self.latest)
+        for offset in range(len(self.ring)):
+            slot = (self.next_slot + offset) % len(self.ring)
+            if slot not in busy:
+                self.next_slot = slot + 1
+                return slot
+
+    def select_source(self):
+        # a substream that kept failing is not tried again; one that could not be probed is, once its probe expires
+        if self.substream == "auto" and self.is_rtsp and self.output_size and not self.substream_failed:
+            self.video_source = selectStream(self.main_source, self.output_size)
+
+    def update_frames(self):
+        self.select_source()
+        self.open_source()
+        stride = self.frame_stride()
+        while not self.stopped:
+            with self.condition:
+                slot = self.free_slot()
+            ret = self.read_into(slot, stride)
+            if ret:
+                if self.state != "connected":
+                    self.failures = 0
+                    self.set_state("connected")
+                with self.condition:
+                    if self.seq > self.read_seq:
+                        # the previous frame was replaced before anyone read it
+                        self.dropped += 1
+                    now = time.time()
+                    if self.timestamp is not None and now > self.timestamp:
+                        self.measured_fps = 0.9 * self.measured_fps + 0.1 / (now - self.timestamp) if self.measured_fps else 1 / (now - self.timestamp)
+                    self.latest = slot
+                    self.seq += 1
+                    self.timestamp = now
+                    self.condition.notify_all()
+                if not self.is_rtsp and self.backend == "opencv":
+                    time.sleep(0.01)  # Small delay so a file source is not read faster than it can be processed
+            else:
+                if self.stopped:
+                    break
+                # capped exponential backoff, so a dead camera is not reopened every second
+                self.failures += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+                logger.error(f"Failed to capture frame from {self.video_source}, reconnecting in {delay:g}s")
+                if self.is_rtsp:
+                    getBandwidthGovernor().reportFrameLoss()
+                if self.video_source != self.main_source and self.failures >= 3:
+                    logger.error("Substream keeps failing, falling back to the main stream")
+                    self.video_source = self.main_source
+                    self.substream_failed = True
+                self.set_state("reconnecting", delay)
+                self.close_source()
+                if self.wakeup.wait(delay):
+                    break
+                self.select_source()
+                self.open_source()
+                stride = self.frame_stride()
+        self.close_source()
+
+    def read_next(self, after_seq = 0, timeout = None):
+        # blocks until a frame newer than after_seq arrives, returns (seq, timestamp, frame) or (after_seq, None, None) on timeout;
+        # the frame is a ring buffer that stays valid until `hold` more frames have been read, copy it to keep it longer
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or self.seq > after_seq, timeout)
+            if self.seq > after_seq:
+                self.read_seq = self.seq
+                self.handed.append(self.latest)
+                return self.seq, self.timestamp, self.ring[self.latest]
+            return after_seq, None, None
+
+    def read(self):
+        with self.condition:
+            frame = self.ring[self.latest].copy() if self.latest is not None else None
+        return frame is not None, frame
+
+    def snapshot(self, main = True):
+        # while on the substream a full resolution still is pulled from the main stream on demand, which takes
+        # an rtsp open, so call it off the frame loop; otherwise the newest frame at decoded or output size
+        if main and self.video_source != self.main_source:
+            frame = grabStill(self.main_source)
+            if frame is not None:
+                return frame
+        with self.raw_lock:
+            if self.raw_latest is not None:
+                return self.raws[self.raw_latest].copy()
+        return self.read()[1]
+
+    def source_fps(self):
+        if self.cap is not None and self.backend == "opencv":
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            if fps:
+                return fps
+        return self.measured_fps
+
+    def release(self):
+        self.stopped = True
+        self.wakeup.set()
+        with self.condition:
+            self.condition.notify_all()
+        proc = self.proc
+        if proc is not None:
+            # unblocks a read waiting on the pipe
+            proc.kill()
+        # a read stuck on a hung stream finishes in the background and releases the capture itself
+        self.thread.join(timeout=5)
@@ -16,25 +16,16 @@ from ftplib import FTP
 from io import BytesIO
 import base64
 import traceback
+from logSetup import setupLogging
+from captureBuffer import VideoCaptureBuffer
+from evidence import configureEvidenceProfiles, getEvidenceProfile, evidenceStats, roiBounds
+import uploadQueue
+from uploadQueue import setupFtp, ThrottledStream, PRIORITY_HEATMAP, getBandwidthGovernor, getUploadExecutor
+from apiClient import getHttpClient
 #crowd  
 # torch.cuda.set_device(0)
 config_path = os.path.join(os.getcwd(), "config.ini")
 
-if not os.path.exists(os.path.join(os.getcwd(), f"heatMap_{datetime.now().date()}.log")):
-    logging.basicConfig(
-        filename=f"heatMap_{datetime.now().date()}.log", 
-        level=logging.ERROR,  
-        format='%(asctime)s - %(levelname)s - %(message)s',  
-        filemode='w'  
-    )
-else:
-    logging.basicConfig(
-        filename=f"heatMap_{datetime.now().date()}.log",
-        level=logging.ERROR,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        filemode='a'  # Append to the file when it exists
-    )
-
 if os.access(config_path, os.R_OK):
         print(f"The user has read permissions for {config_path}")
 else:
@@ -42,101 +33,38 @@ else:
 
 config =  configparser.ConfigParser()
 config.read(config_path)
-class VideoCaptureBuffer:
-    """Efficiently captures frames in a separate thread to reduce lag and distortion."""
-    def __init__(self, video_source):
-        self.video_source = video_source
-        self.cap = cv2.VideoCapture(video_source)
-        self.buffer_frame = None
-        self.stopped = False
-        self.lock = threading.Lock()
-        self.is_rtsp = isinstance(video_source, str) and video_source.startswith("rtsp")
-
-        # Start the frame updating thread
-        self.thread = threading.Thread(target=self.update_frames, daemon=True)
-        self.thread.start()
-
-    def update_frames(self):
-        while not self.stopped:
-            ret, frame = self.cap.read()
-            if ret:
-                with self.lock:
-                    self.buffer_frame = frame
-                time.sleep(0.01)  # Small delay to prevent CPU overuse
-            else:
-                if self.is_rtsp:
-                    print("Failed to capture frame from RTSP, retrying...")
-                    time.sleep(1)
-                else:
-                    print("Failed to capture frame, reinitializing...")
-                    self.cap.release()
-                    self.cap = cv2.VideoCapture(self.video_source)
-                    time.sleep(1)
-
-    def read(self):
-        with self.lock:
-            frame = self.buffer_frame
-        return frame is not None, frame
-
-    def release(self):
-        self.stopped = True
-        self.thread.join()
-        self.cap.release()
-        
+
+setupLogging(None, f"heatMap_{datetime.now().date()}.log", config["Logging"] if config.has_section("Logging") else None)
+
+
+heatMapTable = '''create table IF NOT EXISTS Heatmap_Ananlytics 
+                            (id INTEGER  primary key AUTOINCREMENT,camId varchar(40),roi VARCHAR(50) ,averageTime FLOAT, maxTime FLOAT,minTime FLOAT, 
+                            date timestamp , currentTime timeStamp Default current_timestamp)'''
+
+def getOutbox(schema, dbPath = None):
+    # the outbox db stays next to this script's own code
+    return uploadQueue.getOutbox(schema, dbPath or os.path.join(os.path.dirname(__file__), 'myDatabase.db'))
+
 class setupServer:
     def __init__(self):
         db_path = os.path.join(os.path.dirname(__file__), 'myDatabase.db')
         self.conn = sqlite3.connect(db_path)
         self.cursor = self.conn.cursor()
-        self.cursor.execute('''create table IF NOT EXISTS Heatmap_Ananlytics 
-                            (id INTEGER  primary key AUTOINCREMENT,camId varchar(40),roi VARCHAR(50) ,averageTime FLOAT, maxTime FLOAT,minTime FLOAT, 
-                            date timestamp , currentTime timeStamp Default current_timestamp)''')
+        self.cursor.execute(heatMapTable)
         self.commit
     def commit(self):
         self.conn.commit()
     def close(self):
         self.conn.close()   
 
-class setupFtp:
-    def __init__(self, userName, password, host, port):
-        self.userName = userName
-        self.password = password
-        self.host = host
-        self.port = port
-        # self.ftp = FTP(host = self.host, user = self.userName, passwd = self.password, port = self.port)
-        try:
-            self.ftp = FTP()
-            self.ftp.connect(self.host, self.port)
-            self.ftp.login(self.userName, self.password)
-        except Exception as e:
-            logging.error(f"FTP connection failed: {e}")
-
-        
-    def sendFile(self,fileName, stream):
-        try:
-            res = self.ftp.storbinary(f'STOR {fileName}', stream)
-            msg = 'Upload %s to FTP Server %s.'
-            if res.startswith('226 Transfer complete'):
-                logging.error(msg % ('success', self.host))
-                return True
-            else:
-                logging.error(msg % ('falied', self.host)) 
-                return False  
-        except Exception as e:
-            logging.error(f"Error in sendFile: {e}")
-            return False
-        
-    def close(self):
-        self.ftp.quit()
 
-def sendRequest(url, data):
+def sendRequest(url, data, trafficClass = "heatmap"):
     try:
-        headers = {
-            'content-type': 'application/json',
-        }
-        response = requests.post(url, json=data, headers=headers)
+        response = getHttpClient(config["HTTP"] if config.has_section("HTTP") else None).post(url, data, trafficClass)
+        if response is None:
+            return None
         if response.status_code == 200:
-            logging.error(f"Data sent successfully to {url}")
+            logging.debug("Data sent successfully to %s", url)
             return True
         else:
             logging.error(f"Error in sendRequest: {response.status_code} - {response.text}")
@@ -145,6 +73,7 @@ def sendRequest(url, data):
         logging.error(f"Error in sendRequest: {e}")
         return None
 
+
 def drawHeatMap(new_person_detected_cordinates, heatmap_accumulator, frame):
     for x, y in new_person_detected_cordinates:
         center_x, center_y = x, y 
@@ -173,10 +102,11 @@ def removePersonId(allPersonsPresent, personIds):
             
 def savePreviousData(camId):
     try:
-        conn = setupServer()
-        cursor = conn.cursor
-        cursor.execute('''select * from Heatmap_Ananlytics where camId = ?''', (camId,))
-        rows = cursor.fetchall()
+        conn = getOutbox(heatMapTable).reader()
+        try:
+            rows = conn.execute('''select * from Heatmap_Ananlytics where camId = ?''', (camId,)).fetchall()
+        finally:
+            conn.close()
         if rows:
             data = {}
             for row in rows:
@@ -228,62 +158,59 @@ def saveDataInDB(fileName, rois,camId):
             logging.error("File not found")
             return                                                                                                             
         
-        try:
-            conn = setupServer()
-            cursor = conn.cursor
-        except Exception as e:
-            logging.error(f"Error in setupServer in {camId}: {e}")
-            return
+        outbox = getOutbox(heatMapTable)
         
         with open(filePath, 'r') as f:
             data = json.load(f)
-            if not data:
-                logging.error(f"Data is empty in {camId}")
-                for roi in rois:
-                    cursor.execute('''INSERT INTO Heatmap_Ananlytics (camId,roi, averageTime, maxTime, minTime,  date) values(?,?, ?, ?,?,?)''', (camId, roi, 0, 0,0, datetime.now()))
-                conn.commit()
-            else:
-                for roi in data.keys():
-                    totalTime = 0
-                    minTime = float('inf')
-                    maxTime = float('-inf')
-                    for id, time in data.get(roi).items():
-                        totalTime += time
-                        if time < minTime and time != 0:
-                            minTime = time
-                        if time > maxTime:
-                            maxTime = time
-                    averageTime = totalTime / len(data.get(roi)) if len(data.get(roi)) > 0 else 0
-                    if minTime == float('inf'):
-                        minTime = 0
-                    if maxTime == float('-inf'):
-                        maxTime = 0
-                    cursor.execute('''INSERT INTO Heatmap_Ananlytics (camId, roi, averageTime, maxTime, minTime,  date) values(?,?, ?, ?,?,?)''', (camId, roi, averageTime, maxTime,minTime, datetime.now()))
-                conn.commit()
-            
-            with open(filePath, 'w') as f:
-                json.dump({}, f)
-            cursor.execute('''select * from Heatmap_Ananlytics where camId = ?''', (camId,))
-            rows = cursor.fetchall()
-            print(rows)
-            conn.close()
-            ####### call a api for cloud and if ok response will come delete all the data from the local db
+        rows = []
+        if not data:
+            logging.error(f"Data is empty in {camId}")
+            for roi in rois:
+                rows.append((camId, roi, 0, 0,0, datetime.now()))
+        else:
+            for roi in data.keys():
+                totalTime = 0
+                minTime = float('inf')
+                maxTime = float('-inf')
+                for id, time in data.get(roi).items():
+                    totalTime += time
+                    if time < minTime and time != 0:
+                        minTime = time
+                    if time > maxTime:
+                        maxTime = time
+                averageTime = totalTime / len(data.get(roi)) if len(data.get(roi)) > 0 else 0
+                if minTime == float('inf'):
+                    minTime = 0
+                if maxTime == float('-inf'):
+                    maxTime = 0
+                rows.append((camId, roi, averageTime, maxTime,minTime, datetime.now()))
+        outbox.executemany('''INSERT INTO Heatmap_Ananlytics (camId, roi, averageTime, maxTime, minTime,  date) values(?,?, ?, ?,?,?)''', rows)
+        # the day's file is only cleared once its rows are committed
+        if not outbox.flush(timeout = 30):
+            logging.error(f"Outbox flush timed out in {camId}, keeping {fileName}")
+            return
+        with open(filePath, 'w') as f:
+            json.dump({}, f)
+        ####### call a api for cloud and if ok response will come delete all the data from the local db
     except Exception as e:
         logging.error(f"Error in saveDataInDB in {camId}: {e}")
         return
-     
 
-def updateImage(ftp, frame,compCode, boothCode , exhibitCode, camId,heatmap_accumulator,finalImage = None):
+
+def updateImage(ftp, frame,compCode, boothCode , exhibitCode, camId,heatmap_accumulator,finalImage = None, spool = False, region = None, day = None):
     if frame is not None or finalImage is not None:
-        image_path = f"heatMap_{compCode}_{exhibitCode}_{boothCode}_{camId}_{datetime.now().date()}.jpg"
-        ftpPath = f"Storepulse2/HeatMap/{compCode}_{boothCode}_{exhibitCode}_{camId}_{datetime.now().date()}_heatMapImage.jpg"
+        # a held snapshot keeps the day it was taken, so a retry after midnight still updates that day's heat-map
+        day = day or datetime.now().date()
+        image_path = f"heatMap_{compCode}_{exhibitCode}_{boothCode}_{camId}_{day}.jpg"
+        ftpPath = f"Storepulse2/HeatMap/{compCode}_{boothCode}_{exhibitCode}_{camId}_{day}_heatMapImage.jpg"
         cv2.imwrite(image_path, frame)
-        np.save(f"{compCode}_{boothCode}_{exhibitCode}_{camId}_{datetime.now().date()}_heatMapImage.npy", heatmap_accumulator)
-        success, encoded_image = cv2.imencode('.jpg', frame)
-        if success:
-            image_bytes = encoded_image.tobytes()
+        np.save(f"{compCode}_{boothCode}_{exhibitCode}_{camId}_{day}_heatMapImage.npy", heatmap_accumulator)
+        if spool:
+            return
+        image_bytes = getEvidenceProfile("heatmap").encode(frame, region)
+        if image_bytes is not None:
             stream = BytesIO(image_bytes)
-            res = ftp.sendFile(ftpPath,stream)
+            res = ftp.sendFile(ftpPath, ThrottledStream(stream, getBandwidthGovernor(), "heatmap"))
             if res == False:
                 ftp.close()
                 ftp = setupFtp(config["FTP"]["userName"], config["FTP"]["password"], config["FTP"]["host"], int(config["FTP"]["port"]))
@@ -300,14 +227,22 @@ def updateImage(ftp, frame,compCode, boothCode , exhibitCode, camId,heatmap_accu
             "image": None,
         }
         if finalImage is not None:
-            success, encoded_image = cv2.imencode('.jpg', finalImage)
-            if success:
-                img_base64 = base64.b64encode(encoded_image.tobytes()).decode('utf-8')
+            # the final image is the uploaded snapshot, so its profile encoded bytes are reused
+            final_bytes = image_bytes if finalImage is frame else getEvidenceProfile("heatmap").encode(finalImage, region)
+            if final_bytes is not None:
+                img_base64 = base64.b64encode(final_bytes).decode('utf-8')
                 data.update({"final_image": img_base64})
 
         sendRequest(url, data)
     return        
         
+def submitHeatmap(uploadExecutor, args, kwargs, held):
+    # when the upload queue is full the snapshot is saved locally and held, crowdHeatMap offers it again later
+    def spool():
+        updateImage(*args, spool = True, **kwargs)
+        held.update({"args": args, "kwargs": kwargs, "heldAt": int(time.time())})
+    uploadExecutor.submit(PRIORITY_HEATMAP, updateImage, args, kwargs, spool = spool)
+
 def fetchStartDate(rois, cameraInfo,abortInterval,fileName = None):
     currentTime = datetime.now()
     startTime = currentTime.time()
@@ -357,14 +292,33 @@ def personInsidePolygon(points, person):
 def crowdHeatMap(cameraInfo):
     try:
         video = cameraInfo.get("rtsp_url")
-        cap = VideoCaptureBuffer(video)
         model = YOLO("yolov8s.pt")
         frameWidth =  int(config["Heat-Map"]["frame_width"])
         frameHeight = int(config["Heat-Map"]["frame_height"])
+        # decoded straight to the analysis size into reused buffers
+        captureBackend = config["Heat-Map"].get("capture_backend", "auto")
+        captureSubstream = config["Heat-Map"].get("substream", "auto")
+        analysisFps = float(config["Heat-Map"].get("analysis_fps", 2))
+        # the buffer reconnects a lost camera itself with a capped backoff, the loop only hears about it
+        def onCameraState(state, failures, retryIn):
+            if state == "connected":
+                logging.info(f"Camera {cameraInfo.get('camera_id')} connected")
+            else:
+                logging.error(f"Camera {cameraInfo.get('camera_id')} {state} after {failures} failures, retrying in {retryIn:g}s")
+        cap = VideoCaptureBuffer(video, analysis_fps = analysisFps, output_size = (frameWidth, frameHeight), backend = captureBackend, substream = captureSubstream,
+                                 on_state = onCameraState,
+                                 backoff = float(config["Heat-Map"].get("reconnect_backoff_seconds", 1)),
+                                 max_backoff = float(config["Heat-Map"].get("reconnect_max_backoff_seconds", 30)),
+                                 read_timeout = float(config["Heat-Map"].get("read_timeout_seconds", 10)))
         # rois = config["Pose-Estimation"].get("rois","{}")
         rois = cameraInfo.get("rois", {})
         updateFaceInterval = int(config["Heat-Map"].get("update_frame_interval", 300))
+        heldRetryInterval = int(config["Heat-Map"].get("held_upload_retry_seconds", 30))
+        heldUpload = {}
         ftp = setupFtp(config["FTP"]["userName"], config["FTP"]["password"], config["FTP"]["host"], int(config["FTP"]["port"]))
+        uploadExecutor = getUploadExecutor(config["Upload"] if config.has_section("Upload") else None)
+        getBandwidthGovernor(config["Bandwidth"] if config.has_section("Bandwidth") else None)
+        configureEvidenceProfiles(config)
         compCode = config["Company-Details"]["company_code"]
         exhibitCode =  config["Company-Details"]["exhibition_code"]
         boothCode = config["Company-Details"]["booth_code"]
@@ -381,6 +335,11 @@ def crowdHeatMap(cameraInfo):
 
         # if isinstance(rois, str):
         #     rois = json.loads(rois)
+        # heat-map snapshots are cropped to the union of the camera rois
+        evidenceRegion = None
+        if rois:
+            bounds = [roiBounds(points) for points in rois.values()]
+            evidenceRegion = (min(b[0] for b in bounds), min(b[1] for b in bounds), max(b[2] for b in bounds), max(b[3] for b in bounds))
         if rois == {}:
             rois = {"FS": {"x": [0, frameWidth], "y": [0, frameHeight]}}
             
@@ -398,16 +357,17 @@ def crowdHeatMap(cameraInfo):
         timeDiff = (datetime.now() - startTime).total_seconds()/3600
         newFrame = None
         resultNewFrame = None
+        frameSeq = 0
+        frameTimeout = float(config["Heat-Map"].get("frame_timeout_seconds", 5))
         while timeDiff > 0 and timeDiff < abortInterval:
-            ret, frame = cap.read()
-            if not ret:
-                cap.release()
-                cap = VideoCaptureBuffer(video)
-                time.sleep(1)
+            # each frame is processed once, the wait is bounded so the abort interval is still checked while the camera is away
+            frameSeq, frameTime, frame = cap.read_next(frameSeq, timeout = frameTimeout)
+            if frame is None:
                 continue
 
-            frame = cv2.resize(frame, (frameWidth, frameHeight))
             results = model.track(frame,imgsz = 640, conf=0.2,persist=True, iou = 0.4, tracker = "bytetrack.yaml", verbose =False)
+            # the ids are drawn on a copy, the frame itself is a capture ring slot that gets decoded into again
+            frame = frame.copy()
             for roi in rois.keys():
                 # newFrame = extractImage(frame.copy(), rois.get(roi))
                 # cv2.imwrite(f"masked_{roi}.jpg", newFrame)
@@ -437,17 +397,18 @@ def crowdHeatMap(cameraInfo):
                                 frame = cv2.circle(frame, (x,y), 6,thickness=1, color=(0,0,255))
                                 frame = cv2.putText(frame, f"id: {id} {roi}", (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
                                 
+                                # person times use the capture timestamp, so they stay right at any analysis rate
                                 if id not in allPersonsPresent.get(roi):
-                                    allPersonsPresent.get(roi).update({id: time.time()})
-                                    idTimeMapping.get(roi).update({id: time.time()})
+                                    allPersonsPresent.get(roi).update({id: frameTime})
+                                    idTimeMapping.get(roi).update({id: frameTime})
                                     new_person_detected_cordinates.append((x,y))
                                 
                                 # prevTime = fetchPrevTime(fileName, id)
                                 
                                 time_entry =  allPeronPresentTime.get(roi, {})
                                 prevTime =  time_entry.get(id, 0)
-                                time_entry[id] = prevTime + abs(time.time()- allPersonsPresent.get(roi).get(id))
-                                allPersonsPresent.get(roi).update({id: time.time()})
+                                time_entry[id] = prevTime + abs(frameTime - allPersonsPresent.get(roi).get(id))
+                                allPersonsPresent.get(roi).update({id: frameTime})
                                 saveDataInFile(fileName, time_entry[id], int(idTimeMapping.get(roi).get(id)), roi)
 
                 heatMap = drawHeatMap(new_person_detected_cordinates, heatmap_accumulator, frame)
@@ -461,12 +422,24 @@ def crowdHeatMap(cameraInfo):
             currentTime = int(time.time())
             # if abs(lastUpdatedTime - currentTime) % updateFaceInterval == 0:
             if currentTime - lastUpdatedTime >= updateFaceInterval:
-                threading.Thread(target = updateImage, args=(ftp, resultNewFrame, compCode, boothCode , exhibitCode, camId, heatmap_accumulator)).start()
+                args = (ftp, resultNewFrame, compCode, boothCode , exhibitCode, camId, heatmap_accumulator)
+                # a newer snapshot replaces whatever was still held
+                heldUpload.clear()
+                submitHeatmap(uploadExecutor, args, {"region": evidenceRegion, "day": datetime.now().date()}, heldUpload)
                 # updateImage(ftp, frame, compCode, boothCode , exhibitCode, camId, heatmap_accumulator)
                 lastUpdatedTime = currentTime
+            elif heldUpload and currentTime - heldUpload["heldAt"] >= heldRetryInterval:
+                held = dict(heldUpload)
+                heldUpload.clear()
+                submitHeatmap(uploadExecutor, held["args"], held["kwargs"], heldUpload)
             if cv2.waitKey(1) & 0xFF == ord('q'):  # Press 'q' to exit
                 break
-        updateImage(ftp, resultNewFrame, compCode, boothCode , exhibitCode, camId, heatmap_accumulator, finalImage = resultNewFrame)
+        if heldUpload and heldUpload["kwargs"]["day"] != datetime.now().date():
+            # the final update below only covers today
+            updateImage(*heldUpload["args"], **heldUpload["kwargs"])
+        updateImage(ftp, resultNewFrame, compCode, boothCode , exhibitCode, camId, heatmap_accumulator, finalImage = resultNewFrame, region = evidenceRegion)
+        logging.info(f"Evidence stats: {evidenceStats()}")
+        logging.info(f"Camera {camId} analysed {cap.seq} frames at {cap.measured_fps:.1f} fps, skipped {cap.skipped} at decode, dropped {cap.dropped}")
         saveDataInDB(fileName, rois, camId)
         
 #erase this
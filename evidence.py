@@ -0,0 +1,116 @@
+import logging
+import threading
+import cv2
+
+# evidence image profiles shared by the root level scripts and the Sack-Bag-Count and Dwell_Time apps
+
+logger = logging.getLogger("shared.evidence")
+
+def encodeJpeg(frame):
+    success, encoded_image = cv2.imencode('.jpg', frame)
+    if not success:
+        logger.error("Error encoding frame to jpg")
+        return None
+    return encoded_image.tobytes()
+
+class EvidenceProfile:
+    """How one kind of evidence image is cropped, scaled and encoded before upload."""
+    def __init__(self, name, crop = False, margin = 40, maxDimension = 0, quality = 95, progressive = False, sampleEvery = 10):
+        self.name = name
+        self.crop = crop
+        self.margin = margin
+        self.maxDimension = maxDimension
+        self.quality = quality
+        self.progressive = progressive
+        self.sampleEvery = max(1, sampleEvery)
+        self.events = 0
+        self.bytes = 0
+        self.sampledBytes = 0
+        self.sampledFullBytes = 0
+        self.lock = threading.Lock()
+
+    def prepare(self, frame, region = None, regionSize = None):
+        image = frame
+        if self.crop and region is not None:
+            height, width = frame.shape[:2]
+            # region is in analysis coordinates when the frame is the full resolution source
+            scaleX = width / regionSize[0] if regionSize else 1
+            scaleY = height / regionSize[1] if regionSize else 1
+            x1 = max(0, int((region[0] - self.margin) * scaleX))
+            y1 = max(0, int((region[1] - self.margin) * scaleY))
+            x2 = min(width, int((region[2] + self.margin) * scaleX))
+            y2 = min(height, int((region[3] + self.margin) * scaleY))
+            if x2 > x1 and y2 > y1:
+                image = frame[y1:y2, x1:x2]
+        if self.maxDimension and max(image.shape[:2]) > self.maxDimension:
+            scale = self.maxDimension / max(image.shape[:2])
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return image
+
+    def encode(self, frame, region = None, regionSize = None):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        if self.progressive:
+            params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        success, encoded_image = cv2.imencode('.jpg', self.prepare(frame, region, regionSize), params)
+        if not success:
+            logger.error(f"Error encoding {self.name} evidence")
+            return None
+        data = encoded_image.tobytes()
+        with self.lock:
+            self.events += 1
+            self.bytes += len(data)
+            sample = (self.events - 1) % self.sampleEvery == 0
+        if sample:
+            # the full frame at default quality is only encoded for every sampleEvery-th image to estimate the savings
+            fullData = encodeJpeg(frame)
+            if fullData is not None:
+                with self.lock:
+                    self.sampledBytes += len(data)
+                    self.sampledFullBytes += len(fullData)
+        return data
+
+    def stats(self):
+        with self.lock:
+            ratio = self.sampledFullBytes / self.sampledBytes if self.sampledBytes else 1
+            return {"events": self.events, "bytes": self.bytes, "bytesSaved": int(self.bytes * ratio) - self.bytes}
+
+evidenceProfiles = {}
+evidenceProfilesLock = threading.Lock()
+evidenceConfig = None
+
+def configureEvidenceProfiles(config):
+    # profiles are read from [Evidence-<name>] sections, a missing section keeps the full frame at default quality
+    global evidenceConfig
+    evidenceConfig = config
+
+def getEvidenceProfile(name):
+    with evidenceProfilesLock:
+        profile = evidenceProfiles.get(name)
+        if profile is None:
+            section = f"Evidence-{name}"
+            if evidenceConfig is not None and evidenceConfig.has_section(section):
+                info = evidenceConfig[section]
+                profile = EvidenceProfile(
+                    name,
+                    crop = info.getboolean("crop", False),
+                    margin = info.getint("margin", 40),
+                    maxDimension = info.getint("max_dimension", 0),
+                    quality = info.getint("quality", 95),
+                    progressive = info.getboolean("progressive", False),
+                    sampleEvery = info.getint("sample_every", 10)
+                )
+            else:
+                logger.warning(f"No [{section}] config section, {name} evidence is the full frame at default quality")
+                profile = EvidenceProfile(name)
+            evidenceProfiles[name] = profile
+    return profile
+
+def evidenceStats():
+    with evidenceProfilesLock:
+        profiles = list(evidenceProfiles.values())
+    return {profile.name: profile.stats() for profile in profiles}
+
+def roiBounds(points):
+    xs = [int(point["x"]) for point in points]
+    ys = [int(point["y"]) for point in points]
+    return (min(xs), min(ys), max(xs), max(ys))
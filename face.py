@@ -3,6 +3,8 @@ import numpy as np
 import onnxruntime as ort
 import os
 import logging
+import configparser
+from logSetup import setupLogging
 from datetime import datetime
 
 onnx_model_path = "yolov8n-face.onnx" 
@@ -13,20 +15,9 @@ session = ort.InferenceSession(onnx_model_path, providers=['CPUExecutionProvider
 input_name = session.get_inputs()[0].name
 input_shape = session.get_inputs()[0].shape 
  
-if not os.path.exists(os.path.join(os.getcwd(), f"heatMap_{datetime.now().date()}.log")):
-    logging.basicConfig(
-        filename=f"Detect_Faces_{datetime.now().date()}.log", 
-        level=logging.ERROR,  
-        format='%(asctime)s - %(levelname)s - %(message)s',  
-        filemode='w'  
-    )
-else:
-    logging.basicConfig(
-        filename=f"Detect_Faces_{datetime.now().date()}.log",
-        level=logging.ERROR,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        filemode='a'  # Append to the file when it exists
-    )
+config = configparser.ConfigParser()
+config.read(os.path.join(os.getcwd(), "config.ini"))
+setupLogging(None, f"Detect_Faces_{datetime.now().date()}.log", config["Logging"] if config.has_section("Logging") else None)
 
 def preprocess(img, input_size=(640, 640)):
     try:
@@ -4,22 +4,13 @@ import time
 import threading
 import os
 import logging
+import configparser
+from logSetup import setupLogging
 from datetime import datetime
 
-if not os.path.exists(os.path.join(os.getcwd(), f"heatMap_{datetime.now().date()}.log")):
-    logging.basicConfig(
-        filename=f"Detect_Faces_{datetime.now().date()}.log", 
-        level=logging.ERROR,  
-        format='%(asctime)s - %(levelname)s - %(message)s',  
-        filemode='w'  
-    )
-else:
-    logging.basicConfig(
-        filename=f"Detect_Faces_{datetime.now().date()}.log",
-        level=logging.ERROR,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        filemode='a'  # Append to the file when it exists
-    )
+config = configparser.ConfigParser()
+config.read(os.path.join(os.getcwd(), "config.ini"))
+setupLogging(None, f"Detect_Faces_{datetime.now().date()}.log", config["Logging"] if config.has_section("Logging") else None)
         
 def faces():
     try:
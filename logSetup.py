@@ -0,0 +1,91 @@
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import threading
+import time
+import queue
+import atexit
+
+# shared by the root level scripts and, through their utilities, the Sack-Bag-Count and Dwell_Time apps
+
+class RateLimitFilter(logging.Filter):
+    """Lets a repeated message through once per interval and counts the copies it held back."""
+    def __init__(self, interval = 30):
+        super().__init__()
+        self.interval = interval
+        self.seen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.interval <= 0:
+            return True
+        # keyed by call site and text, so one camera failing does not hide another
+        key = (record.name, record.pathname, record.lineno, record.getMessage())
+        now = time.monotonic()
+        with self.lock:
+            last, suppressed = self.seen.get(key, (None, 0))
+            if last is not None and now - last < self.interval:
+                self.seen[key] = (last, suppressed + 1)
+                return False
+            self.seen[key] = (now, 0)
+            if len(self.seen) > 10000:
+                self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.interval}
+        if suppressed:
+            record.msg = f"{record.getMessage()} (repeated {suppressed} more times in the last {int(now - last)}s)"
+            record.args = None
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking the caller when the log writer falls behind."""
+    def __init__(self, logQueue):
+        super().__init__(logQueue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+logListeners = []
+
+SHARED_LOGGER = "shared"
+
+def setupLogging(loggerName, logPath, logInfo = None, shared = False):
+    # records are queued by the caller and written to a rotating file by one listener thread;
+    # loggerName None sets up the root logger, which every other logger already propagates to.
+    # shared also writes the "shared" loggers of the capture, evidence, upload and api modules to this file
+    logger = logging.getLogger(loggerName)
+    if logger.handlers:
+        return logger
+    getValue = (lambda key, default: logInfo.get(key, default)) if logInfo is not None else (lambda key, default: default)
+    logger.setLevel(getValue("level", "INFO").upper())
+    # <subsystem>_level sets the level of the <loggerName>.<subsystem> child logger
+    for key in (logInfo or {}):
+        if key.endswith("_level") and key != "level":
+            subsystem = key[:-len('_level')]
+            logging.getLogger(subsystem if loggerName is None else f"{loggerName}.{subsystem}").setLevel(logInfo[key].upper())
+            logging.getLogger(f"{SHARED_LOGGER}.{subsystem}").setLevel(logInfo[key].upper())
+
+    fileHandler = RotatingFileHandler(logPath, maxBytes = int(getValue("max_bytes", 10 * 1024 * 1024)),
+                                      backupCount = int(getValue("backup_count", 5)))
+    fileHandler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    queueHandler = DroppingQueueHandler(queue.Queue(maxsize = int(getValue("queue_size", 10000))))
+    queueHandler.addFilter(RateLimitFilter(float(getValue("rate_limit_seconds", 30))))
+    listener = QueueListener(queueHandler.queue, fileHandler, respect_handler_level = True)
+    listener.start()
+    logListeners.append(listener)
+    logger.addHandler(queueHandler)
+    if loggerName is not None:
+        logger.propagate = False
+    if shared and loggerName is not None:
+        sharedLogger = logging.getLogger(SHARED_LOGGER)
+        sharedLogger.setLevel(logger.level)
+        sharedLogger.addHandler(queueHandler)
+        sharedLogger.propagate = False
+    return logger
+
+@atexit.register
+def stopLogging():
+    # flushes whatever is still queued when the process exits
+    while logListeners:
+        logListeners.pop().stop()
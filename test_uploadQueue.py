@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import uploadQueue
+from uploadQueue import BandwidthGovernor, ImageSpool, Outbox, RateLimiter
+
+# run from the repository root: python -m unittest test_uploadQueue
+
+
+class FakeClock:
+    """Stands in for the time module, sleeping only moves the clock forward."""
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+class BandwidthGovernorTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(uploadQueue, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_count_gets_the_full_rate(self):
+        governor = BandwidthGovernor(bytesPerSecond = 1000)
+        governor.acquire(600, "count")
+        self.assertEqual(self.clock.slept, 0)
+
+    def test_backlog_is_held_to_its_share(self):
+        governor = BandwidthGovernor(bytesPerSecond = 1000, shares = {"backlog": 0.3})
+        governor.acquire(600, "backlog")
+        # 300 bytes of burst, the other 300 at 300 bytes per second
+        self.assertAlmostEqual(self.clock.slept, 1.0)
+
+    def test_unknown_class_is_treated_as_backlog(self):
+        governor = BandwidthGovernor(bytesPerSecond = 1000, shares = {"backlog": 0.5})
+        governor.acquire(1000, "unheard_of")
+        self.assertAlmostEqual(self.clock.slept, 1.0)
+        self.assertEqual(governor.stats()["sent"]["backlog"], 1000)
+
+    def test_classes_share_the_total(self):
+        governor = BandwidthGovernor(bytesPerSecond = 1000)
+        governor.acquire(1000, "count")
+        governor.acquire(500, "alert")
+        # the alert share still has tokens, the total bucket is empty
+        self.assertAlmostEqual(self.clock.slept, 0.5)
+
+    def test_frame_loss_backs_off_and_recovers(self):
+        governor = BandwidthGovernor(bytesPerSecond = 1000, lossBackoff = 0.5, minFraction = 0.2, recoverySeconds = 10)
+        governor.reportFrameLoss()
+        self.assertEqual(governor.stats()["bytesPerSecond"], 500)
+        # several failed reads within a second back off once
+        governor.reportFrameLoss()
+        self.assertEqual(governor.stats()["bytesPerSecond"], 500)
+        self.clock.now += 10
+        governor.acquire(1, "count")
+        self.assertEqual(governor.stats()["bytesPerSecond"], 1000)
+
+    def test_zero_rate_is_unlimited(self):
+        governor = BandwidthGovernor()
+        governor.acquire(10 ** 9, "backlog")
+        self.assertEqual(self.clock.slept, 0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(uploadQueue, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(10, burst = 5)
+        for _ in range(5):
+            limiter.acquire()
+        self.assertEqual(self.clock.slept, 0)
+        limiter.acquire()
+        self.assertAlmostEqual(self.clock.slept, 0.1)
+
+    def test_waits_while_live_uploads_are_queued(self):
+        busy = iter([True, True, False])
+        limiter = RateLimiter(10, busy = lambda: next(busy))
+        limiter.acquire()
+        self.assertAlmostEqual(self.clock.slept, 0.2)
+
+    def test_zero_rate_only_waits_for_live_uploads(self):
+        limiter = RateLimiter(0)
+        for _ in range(100):
+            limiter.acquire()
+        self.assertEqual(self.clock.slept, 0)
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.outbox = Outbox(os.path.join(self.folder, "outbox.db"), "create table if not exists records (id integer primary key, value text)",
+                             flushInterval = 0.05)
+
+    def count(self):
+        conn = self.outbox.reader()
+        try:
+            return conn.execute("select count(*) from records").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_writes_from_many_threads_go_through_one_writer(self):
+        def write(thread):
+            for index in range(50):
+                self.outbox.execute("insert into records (value) values (?)", (f"{thread}-{index}",))
+
+        threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(self.outbox.flush(timeout = 5))
+        self.assertEqual(self.count(), 400)
+
+    def test_submit_runs_on_the_writer_cursor(self):
+        self.outbox.execute("insert into records (value) values (?)", ("a",))
+
+        def write(cursor):
+            cursor.execute("select count(*) from records")
+            cursor.execute("insert into records (value) values (?)", (f"seen {cursor.fetchone()[0]}",))
+
+        self.outbox.submit(write)
+        self.assertTrue(self.outbox.flush(timeout = 5))
+        conn = self.outbox.reader()
+        try:
+            self.assertEqual(conn.execute("select value from records order by id").fetchall(), [("a",), ("seen 1",)])
+        finally:
+            conn.close()
+
+    def test_a_failed_write_does_not_drop_the_batch(self):
+        with self.assertLogs("shared.upload", level = "ERROR"):
+            self.outbox.execute("insert into missing (value) values (?)", ("lost",))
+            self.outbox.executemany("insert into records (value) values (?)", [("b",), ("c",)])
+            self.assertTrue(self.outbox.flush(timeout = 5))
+        self.assertEqual(self.count(), 2)
+
+
+class ImageSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_interrupted_drain_is_recovered(self):
+        with self.assertLogs("shared.upload", level = "ERROR"):
+            spool = ImageSpool(self.root)
+            spool.put(os.path.join("day", "a.jpg"), b"a")
+            spool.put(os.path.join("day", "b.jpg"), b"b")
+        # a drain moved the manifest aside and uploaded a.jpg before the process died
+        os.replace(spool.manifestPath, spool.drainingPath)
+        os.remove(os.path.join(self.root, "day", "a.jpg"))
+
+        restarted = ImageSpool(self.root)
+        self.assertFalse(os.path.exists(restarted.drainingPath))
+        uploaded = []
+        self.assertEqual(restarted.drain(lambda path, relPath: uploaded.append(relPath) or True), 1)
+        self.assertEqual(uploaded, ["day/b.jpg"])
+        self.assertFalse(os.path.exists(os.path.join(self.root, "day")))
+
+    def test_failed_uploads_stay_in_the_manifest(self):
+        with self.assertLogs("shared.upload", level = "ERROR"):
+            spool = ImageSpool(self.root)
+            spool.put("a.jpg", b"a")
+        self.assertEqual(spool.drain(lambda path, relPath: False), 0)
+        self.assertEqual(spool.readEntries(spool.manifestPath), ["a.jpg"])
+        self.assertEqual(spool.drain(lambda path, relPath: True), 1)
+        self.assertEqual(spool.readEntries(spool.manifestPath), [])
+
+    def test_images_spooled_before_the_manifest_are_found(self):
+        os.makedirs(os.path.join(self.root, "old"))
+        with open(os.path.join(self.root, "old", "frame.jpg"), "wb") as f:
+            f.write(b"frame")
+        spool = ImageSpool(self.root)
+        self.assertEqual(spool.readEntries(spool.manifestPath), [os.path.join("old", "frame.jpg")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,613 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import itertools
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import FTP, all_errors, error_perm
+from io import BytesIO
+
+# ftp, upload queue, bandwidth and local outbox layer shared by the root level scripts and the
+# Sack-Bag-Count and Dwell_Time apps; it needs nothing outside the standard library
+
+logger = logging.getLogger("shared.upload")
+
+class setupFtp:
+    def __init__(self, userName, password, host, port, timeout = 10):
+        self.userName = userName
+        self.password = password
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ftp = None
+        self.connect()
+        # self.ftp = FTP(host = self.host, user = self.userName, passwd = self.password, port = self.port)
+
+            
+    def connect(self):
+        try:
+            self.ftp = FTP()
+            self.ftp.connect(self.host, self.port, timeout=self.timeout)
+            self.ftp.login(self.userName, self.password)
+            logger.info(f"Connected to FTP server {self.host}:{self.port}")
+        except all_errors as e:
+            logger.error(f"FTP connection failed: {e}")
+            self.ftp = None
+            
+    def sendFile(self,fileName, stream):
+        if not self.ftp:
+            logger.error("FTP connection is not established.")
+            return False
+        try:
+            res = self.ftp.storbinary(f'STOR {fileName}', stream)
+            msg = 'Upload %s to FTP Server %s.'
+            if res.startswith('226 Transfer complete'):
+                logger.debug(msg, 'success', self.host)
+                return True
+            else:
+                logger.error(msg, 'failed', self.host)
+                return False  
+        except all_errors as e:
+            logger.error(f"Error in sendFile: {e}")
+            return False
+        
+    def noop(self):
+        if not self.ftp:
+            return False
+        try:
+            self.ftp.voidcmd("NOOP")
+            return True
+        except all_errors as e:
+            logger.error(f"FTP keepalive failed: {e}")
+            return False
+
+    def close(self):
+        if self.ftp:
+            try:
+                self.ftp.quit() 
+                logger.info("FTP connection closed.")
+            except all_errors as e:
+                logger.error(f"Error closing FTP connection: {e}")
+            finally:
+                self.ftp = None
+        else:
+            logger.error("FTP connection is not established.")
+            return 
+
+TRAFFIC_SHARES = {"count": 1.0, "alert": 0.8, "heatmap": 0.3, "backlog": 0.3}
+
+class BandwidthGovernor:
+    """Byte token bucket over every outbound upload, with a ceiling per traffic class and backoff while capture loses frames."""
+    def __init__(self, bytesPerSecond = 0, shares = None, lossBackoff = 0.5, minFraction = 0.2, recoverySeconds = 30):
+        self.rate = bytesPerSecond
+        self.shares = dict(TRAFFIC_SHARES, **(shares or {}))
+        self.lossBackoff = lossBackoff
+        self.minFraction = minFraction
+        self.recoverySeconds = recoverySeconds
+        self.fraction = 1.0
+        self.tokens = self.rate
+        self.classTokens = {trafficClass: self.rate * share for trafficClass, share in self.shares.items()}
+        self.sent = {trafficClass: 0 for trafficClass in self.shares}
+        self.updatedAt = time.monotonic()
+        self.lastLoss = 0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        elapsed = now - self.updatedAt
+        self.updatedAt = now
+        # after a frame loss the rate climbs back linearly to full over recoverySeconds
+        self.fraction = min(1.0, self.fraction + elapsed * (1 - self.minFraction) / self.recoverySeconds)
+        rate = self.rate * self.fraction
+        self.tokens = min(rate, self.tokens + elapsed * rate)
+        for trafficClass, share in self.shares.items():
+            self.classTokens[trafficClass] = min(rate * share, self.classTokens[trafficClass] + elapsed * rate * share)
+
+    def acquire(self, size, trafficClass = "backlog"):
+        if self.rate <= 0 or size <= 0:
+            return
+        if trafficClass not in self.shares:
+            trafficClass = "backlog"
+        with self.lock:
+            self.refill(time.monotonic())
+            # the bytes are reserved now and the debt is slept off, so concurrent senders queue up behind each other
+            self.tokens -= size
+            self.classTokens[trafficClass] -= size
+            self.sent[trafficClass] += size
+            rate = self.rate * self.fraction
+            wait = max(0, -self.tokens / rate, -self.classTokens[trafficClass] / (rate * self.shares[trafficClass]))
+        if wait:
+            time.sleep(wait)
+
+    def reportFrameLoss(self):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            # one backoff per second, a reconnect loop reports many failed reads in a row
+            if now - self.lastLoss >= 1:
+                self.fraction = max(self.minFraction, self.fraction * self.lossBackoff)
+                self.lastLoss = now
+
+    def stats(self):
+        with self.lock:
+            return {"bytesPerSecond": int(self.rate * self.fraction), "sent": dict(self.sent)}
+
+class ThrottledStream:
+    """File-like wrapper taking bandwidth tokens for every block storbinary reads."""
+    def __init__(self, stream, governor, trafficClass):
+        self.stream = stream
+        self.governor = governor
+        self.trafficClass = trafficClass
+
+    def read(self, size = -1):
+        data = self.stream.read(size)
+        if data:
+            self.governor.acquire(len(data), self.trafficClass)
+        return data
+
+bandwidthGovernor = None
+bandwidthGovernorLock = threading.Lock()
+
+def getBandwidthGovernor(bandwidthInfo = None):
+    # the first caller configures the shared governor, later callers just get it
+    global bandwidthGovernor
+    with bandwidthGovernorLock:
+        if bandwidthGovernor is None:
+            if bandwidthInfo is None:
+                bandwidthGovernor = BandwidthGovernor()
+            else:
+                bandwidthGovernor = BandwidthGovernor(
+                    bytesPerSecond = bandwidthInfo.getint("bytes_per_second", 0),
+                    shares = {trafficClass: bandwidthInfo.getfloat(f"share_{trafficClass}", share) for trafficClass, share in TRAFFIC_SHARES.items()},
+                    lossBackoff = bandwidthInfo.getfloat("loss_backoff", 0.5),
+                    minFraction = bandwidthInfo.getfloat("min_fraction", 0.2),
+                    recoverySeconds = bandwidthInfo.getfloat("recovery_seconds", 30)
+                )
+    return bandwidthGovernor
+
+class FtpPool:
+    """Logged-in FTP sessions shared by every upload, kept alive with NOOP and reconnected when they drop."""
+    def __init__(self, userName, password, host, port, size = 4, keepalive = 60, timeout = 10):
+        self.userName = userName
+        self.password = password
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.size = size
+        self.idle = []
+        self.directories = set()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+        self.thread = threading.Thread(target=self.keepAlive, daemon=True)
+        self.thread.start()
+
+    def acquire(self):
+        self.slots.acquire()
+        with self.lock:
+            session = self.idle.pop() if self.idle else None
+        if session is not None:
+            ftp, lastUsed = session
+            if time.monotonic() - lastUsed < self.keepalive or ftp.noop():
+                return ftp
+            ftp.close()
+        ftp = setupFtp(self.userName, self.password, self.host, self.port, timeout = self.timeout)
+        if ftp.ftp is None:
+            self.slots.release()
+            return None
+        return ftp
+
+    def release(self, ftp, healthy = True):
+        if healthy and ftp.ftp is not None:
+            with self.lock:
+                # never keep more sessions than there are slots to use them
+                keep = len(self.idle) < self.size
+                if keep:
+                    self.idle.append((ftp, time.monotonic()))
+            if not keep:
+                ftp.close()
+        else:
+            ftp.close()
+        self.slots.release()
+
+    def makeDirs(self, ftp, path):
+        missing = []
+        while path not in ('', '.', '/') and path not in self.directories:
+            missing.append(path)
+            path = os.path.dirname(path)
+        for directory in reversed(missing):
+            try:
+                ftp.ftp.mkd(directory)
+            except error_perm as e:
+                # 550 is already there, a real permission problem surfaces on STOR
+                if not str(e).startswith("550"):
+                    raise
+            # a dropped session or timeout raises before the directory is cached, so the next upload creates it again
+            self.directories.add(directory)
+
+    def forgetDirs(self, path):
+        while path not in ('', '.', '/'):
+            self.directories.discard(path)
+            path = os.path.dirname(path)
+
+    def mkdir(self, path):
+        ftp = self.acquire()
+        if ftp is None:
+            return False
+        healthy = False
+        try:
+            self.makeDirs(ftp, path)
+            healthy = True
+        except all_errors as e:
+            logger.error(f"Error in FtpPool mkdir: {e}")
+        finally:
+            self.release(ftp, healthy = healthy)
+        return healthy
+
+    def uploadBytes(self, data, ftpPath, trafficClass = "alert"):
+        return self.send(lambda: BytesIO(data), ftpPath, trafficClass)
+
+    def uploadFile(self, filePath, ftpPath, trafficClass = "backlog"):
+        return self.send(lambda: open(filePath, "rb"), ftpPath, trafficClass)
+
+    def send(self, openStream, ftpPath, trafficClass):
+        for attempt in range(2):
+            ftp = self.acquire()
+            if ftp is None:
+                return False
+            res = False
+            try:
+                self.makeDirs(ftp, os.path.dirname(ftpPath))
+                with openStream() as stream:
+                    res = ftp.sendFile(ftpPath, ThrottledStream(stream, getBandwidthGovernor(), trafficClass))
+            except all_errors as e:
+                logger.error(f"Error in FtpPool upload: {e}")
+            finally:
+                self.release(ftp, healthy = res)
+            if res:
+                return True
+            # the session may have been dropped by the server or a directory removed, retry once on a fresh one
+            # and create the whole chain again
+            self.forgetDirs(os.path.dirname(ftpPath))
+        return False
+
+    def keepAlive(self):
+        while True:
+            time.sleep(self.keepalive)
+            with self.lock:
+                pending = len(self.idle)
+            # check each session out through a slot like an upload would, so acquire never sees the pool empty
+            # while the NOOPs run and opens extra sessions; a busy pool skips the round
+            for _ in range(pending):
+                if not self.slots.acquire(blocking=False):
+                    break
+                with self.lock:
+                    session = self.idle.pop(0) if self.idle else None
+                if session is None:
+                    self.slots.release()
+                    break
+                ftp, lastUsed = session
+                self.release(ftp, healthy = ftp.noop())
+
+ftpPools = {}
+ftpPoolsLock = threading.Lock()
+
+def getFtpPool(ftpInfo):
+    key = (ftpInfo.get("host"), int(ftpInfo.get("port")), ftpInfo.get("username"))
+    with ftpPoolsLock:
+        pool = ftpPools.get(key)
+        if pool is None:
+            pool = FtpPool(ftpInfo.get("username"), ftpInfo.get("password"), ftpInfo.get("host"), int(ftpInfo.get("port")),
+                           size = ftpInfo.getint("pool_size", 4), keepalive = ftpInfo.getint("keepalive_seconds", 60))
+            ftpPools[key] = pool
+    return pool
+
+PRIORITY_COUNT = 0
+PRIORITY_IMAGE = 1
+PRIORITY_HEATMAP = 2
+
+class UploadExecutor:
+    """Fixed set of upload workers behind a bounded priority queue, jobs that do not fit go straight to the local spool."""
+    def __init__(self, workers = 4, maxQueue = 200):
+        self.jobs = queue.PriorityQueue(maxsize=maxQueue)
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.spooled = 0
+        self.waitTotal = 0.0
+        self.runTotal = 0.0
+        self.maxWait = 0.0
+
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, priority, fn, args = (), kwargs = None, spool = None):
+        job = (priority, next(self.sequence), time.monotonic(), fn, args, kwargs or {})
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            logger.error(f"Upload queue full, spooling {fn.__name__} locally")
+            with self.lock:
+                self.spooled += 1
+            if spool is not None:
+                try:
+                    spool()
+                except Exception:
+                    logger.error(f"Error spooling {fn.__name__}:\n" + traceback.format_exc())
+            return False
+        with self.lock:
+            self.submitted += 1
+        return True
+
+    def run(self):
+        while True:
+            priority, _, submittedAt, fn, args, kwargs = self.jobs.get()
+            startedAt = time.monotonic()
+            failed = False
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                failed = True
+                logger.error(f"Error in upload job {fn.__name__}:\n" + traceback.format_exc())
+            finishedAt = time.monotonic()
+            with self.lock:
+                self.completed += 1
+                self.failed += failed
+                self.waitTotal += startedAt - submittedAt
+                self.runTotal += finishedAt - startedAt
+                self.maxWait = max(self.maxWait, startedAt - submittedAt)
+            self.jobs.task_done()
+
+    def stats(self):
+        with self.lock:
+            completed = self.completed
+            return {
+                "depth": self.jobs.qsize(),
+                "submitted": self.submitted,
+                "completed": completed,
+                "failed": self.failed,
+                "spooled": self.spooled,
+                "avgWaitMs": round(self.waitTotal / completed * 1000, 1) if completed else 0,
+                "maxWaitMs": round(self.maxWait * 1000, 1),
+                "avgRunMs": round(self.runTotal / completed * 1000, 1) if completed else 0,
+            }
+
+uploadExecutor = None
+uploadExecutorLock = threading.Lock()
+
+def getUploadExecutor(uploadInfo = None):
+    # the first caller configures the shared executor, later callers just get it
+    global uploadExecutor
+    with uploadExecutorLock:
+        if uploadExecutor is None:
+            workers = uploadInfo.getint("workers", 4) if uploadInfo is not None else 4
+            maxQueue = uploadInfo.getint("max_queue", 200) if uploadInfo is not None else 200
+            uploadExecutor = UploadExecutor(workers = workers, maxQueue = maxQueue)
+    return uploadExecutor
+
+class ImageSpool:
+    """Encoded images waiting for FTP, listed in a manifest so the drain never walks the folder tree."""
+    def __init__(self, root):
+        self.root = root
+        self.manifestPath = os.path.join(root, "manifest.txt")
+        self.drainingPath = self.manifestPath + ".draining"
+        self.lock = threading.Lock()
+        self.drainLock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self.drainingPath):
+            # a drain stopped half way, whatever it did not delete is still pending
+            self.append(self.readEntries(self.drainingPath))
+            os.remove(self.drainingPath)
+        elif not os.path.exists(self.manifestPath):
+            # images spooled as decoded frames before the manifest existed
+            self.append(self.walk())
+
+    def walk(self):
+        entries = []
+        for folder, _, files in os.walk(self.root):
+            for file in files:
+                if file.endswith(".jpg"):
+                    entries.append(os.path.relpath(os.path.join(folder, file), self.root))
+        return entries
+
+    def readEntries(self, path):
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def append(self, entries):
+        with open(self.manifestPath, "a") as f:
+            for entry in entries:
+                f.write(entry + "\n")
+
+    def put(self, relPath, data):
+        path = os.path.join(self.root, relPath)
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            self.append([relPath])
+        logger.error(f"Image saved to {path}")
+
+    def prune(self, folder):
+        with self.lock:
+            while os.path.abspath(folder) != os.path.abspath(self.root) and os.path.isdir(folder) and not os.listdir(folder):
+                os.rmdir(folder)
+                folder = os.path.dirname(folder)
+
+    def drain(self, upload, workers = 1, limiter = None):
+        # upload(path, relPath) streams one spooled file and returns True once it is on the server
+        if not self.drainLock.acquire(blocking=False):
+            return 0
+        try:
+            with self.lock:
+                if not os.path.exists(self.manifestPath):
+                    return 0
+                os.replace(self.manifestPath, self.drainingPath)
+            entries = [relPath for relPath in dict.fromkeys(self.readEntries(self.drainingPath)) if os.path.exists(os.path.join(self.root, relPath))]
+
+            def send(relPath):
+                if limiter is not None:
+                    limiter.acquire()
+                path = os.path.join(self.root, relPath)
+                if not upload(path, relPath.replace(os.sep, "/")):
+                    return False
+                os.remove(path)
+                self.prune(os.path.dirname(path))
+                return True
+
+            with ThreadPoolExecutor(max_workers = workers) as executor:
+                results = list(executor.map(send, entries))
+            remaining = [relPath for relPath, ok in zip(entries, results) if not ok]
+            with self.lock:
+                self.append(remaining)
+                os.remove(self.drainingPath)
+            return len(entries) - len(remaining)
+        finally:
+            self.drainLock.release()
+
+imageSpools = {}
+imageSpoolsLock = threading.Lock()
+
+def getImageSpool(root):
+    key = os.path.abspath(root)
+    with imageSpoolsLock:
+        spool = imageSpools.get(key)
+        if spool is None:
+            spool = ImageSpool(root)
+            imageSpools[key] = spool
+    return spool
+
+class Outbox:
+    """Single writer for the local sqlite outbox, one WAL connection committing queued writes in batches."""
+    def __init__(self, dbPath, schema, batchSize = 100, flushInterval = 0.5):
+        self.dbPath = dbPath
+        self.schema = schema
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.writes = queue.Queue()
+        self.ready = threading.Event()
+        self.drainLock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.dbPath, timeout = 30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def execute(self, sql, params = ()):
+        self.writes.put(("execute", sql, params))
+
+    def executemany(self, sql, rows):
+        self.writes.put(("executemany", sql, list(rows)))
+
+    def submit(self, write):
+        # write(cursor) runs on the writer thread inside the current batch transaction
+        self.writes.put(("call", write, None))
+
+    def flush(self, timeout = None):
+        done = threading.Event()
+        self.writes.put(("flush", done, None))
+        return done.wait(timeout)
+
+    def reader(self):
+        # readers get their own connection, WAL lets them read while the writer commits
+        self.ready.wait()
+        return self.connect()
+
+    def run(self):
+        conn = self.connect()
+        conn.execute(self.schema)
+        conn.commit()
+        self.ready.set()
+        cursor = conn.cursor()
+        while True:
+            batch = [self.writes.get()]
+            deadline = time.monotonic() + self.flushInterval
+            while len(batch) < self.batchSize and batch[-1][0] != "flush":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.writes.get(timeout = remaining))
+                except queue.Empty:
+                    break
+            flushed = []
+            for kind, statement, params in batch:
+                try:
+                    if kind == "flush":
+                        flushed.append(statement)
+                    elif kind == "call":
+                        statement(cursor)
+                    elif kind == "executemany":
+                        cursor.executemany(statement, params)
+                    else:
+                        cursor.execute(statement, params)
+                except Exception:
+                    logger.error("Error writing to outbox:\n" + traceback.format_exc())
+            try:
+                conn.commit()
+            except sqlite3.Error:
+                logger.error("Error committing outbox batch:\n" + traceback.format_exc())
+                conn.rollback()
+            for done in flushed:
+                done.set()
+
+outboxes = {}
+outboxesLock = threading.Lock()
+
+def getOutbox(schema, dbPath):
+    # one writer per database file, each app passes the db it keeps next to its own code
+    with outboxesLock:
+        outbox = outboxes.get(dbPath)
+        if outbox is None:
+            outbox = Outbox(dbPath, schema)
+            outboxes[dbPath] = outbox
+    return outbox
+
+class RateLimiter:
+    """Token bucket for backlog requests, it also holds back while live uploads are queued so they go first."""
+    def __init__(self, rate, burst = None, busy = None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.busy = busy
+        self.tokens = self.burst
+        self.updatedAt = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while self.busy is not None and self.busy():
+            time.sleep(0.1)
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updatedAt) * self.rate)
+            self.updatedAt = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+drainLimiter = None
+drainLimiterLock = threading.Lock()
+
+def getDrainLimiter(drainInfo = None):
+    # shared by the record and image drains so their combined rate stays under requests_per_second
+    global drainLimiter
+    with drainLimiterLock:
+        if drainLimiter is None:
+            rate = drainInfo.getfloat("requests_per_second", 10) if drainInfo is not None else 10
+            drainLimiter = RateLimiter(rate, busy = lambda: uploadExecutor is not None and uploadExecutor.jobs.qsize() > 0)
+    return drainLimiter